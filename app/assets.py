@@ -0,0 +1,231 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import stat
+from pathlib import Path
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+
+from app.config import config
+
+try:
+    import brotli
+except ImportError: # Optional: without it, only the gzip copies are built
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError: # Optional: without Pillow, the images are only fingerprinted (no variants)
+    Image = None
+
+
+# -- Notes:
+# The build (python -m app.assets) copies every static file to static/dist with the hash of its content in
+# the name (e.g. custom.3f2a9c1b7d4e.css), and writes manifest.json, which maps the original names to the
+# copies. A fingerprinted file never changes, so it's served with "Cache-Control: immutable": the browser
+# keeps it without revalidating, and a new version gets a new name (and a new URL in the pages).
+# Without a build, the templates link the original files, which are revalidated on every use.
+
+logger = logging.getLogger(__name__)
+
+BUILD_DIR = "dist" # Subdirectory of the static files with the built assets
+MANIFEST_FILE = "manifest.json"
+COMPRESSED_TYPES = {".css", ".js", ".svg", ".ico", ".json", ".txt"} # The images are already compressed
+IMAGE_TYPES = {".jpeg", ".jpg", ".png", ".webp", ".avif"}
+IMAGE_WIDTHS = (480, 960, 1920) # Widths of the resized variants (up to the width of the original)
+IMAGE_QUALITY = {"WEBP": 80, "AVIF": 60} # AVIF reaches the same visual quality at a lower setting
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable" # One year, without revalidation
+REVALIDATE_CACHE_CONTROL = "no-cache" # Cached, but revalidated (with the ETag) before every use
+ENCODINGS = {"br": ".br", "gzip": ".gz"} # Precompressed copies, in order of preference
+
+_manifest: dict | None = None
+
+
+# -- Build
+
+def _fingerprint(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def _compress(path: Path) -> None:
+    content = path.read_bytes()
+    copies = {".gz": gzip.compress(content, compresslevel=9, mtime=0)} # mtime=0: the same file on every build
+    if brotli is not None:
+        copies[".br"] = brotli.compress(content, quality=11)
+    for suffix, compressed in copies.items():
+        if len(compressed) < len(content): # A tiny file can grow when compressed
+            path.with_name(path.name + suffix).write_bytes(compressed)
+
+
+def _image_formats() -> list[tuple[str, str, str]]:
+    # (extension, media type, Pillow format) of the variants that this Pillow can write
+    formats = [("webp", "image/webp", "WEBP")]
+    if features.check("avif"):
+        formats.append(("avif", "image/avif", "AVIF"))
+    return formats
+
+
+def _image_variants(source: Path, output_dir: Path, stem: str) -> list[dict]:
+    if Image is None:
+        return []
+    try:
+        image = Image.open(source)
+        image.load()
+    except OSError: # A format that this Pillow can't read (e.g. AVIF without its plugin)
+        logger.warning("No variants of %s: Pillow can't read it", source.name)
+        return []
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    variants = []
+    widths = [width for width in IMAGE_WIDTHS if width < image.width] + [image.width]
+    for width in widths:
+        height = round(image.height * width / image.width)
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for extension, media_type, image_format in _image_formats():
+            name = f"{stem}.{width}.{extension}"
+            if not (output_dir / name).exists(): # Same fingerprint, same variant: kept from a previous build
+                resized.save(output_dir / name, image_format, quality=IMAGE_QUALITY[image_format])
+            variants.append({"file": name, "width": width, "type": media_type})
+    return variants
+
+
+def build_assets(static_dir: Path, clean: bool = False) -> dict:
+    """Builds the fingerprinted, compressed and resized copies of the static files, returning the manifest.
+
+    The copies of the previous builds are kept (the pages cached by the clients may still link them),
+    unless clean is True."""
+    output_dir = static_dir / BUILD_DIR
+    output_dir.mkdir(exist_ok=True)
+    if clean:
+        for path in output_dir.iterdir():
+            path.unlink()
+
+    manifest = {}
+    for source in sorted(static_dir.iterdir()):
+        if not source.is_file():
+            continue # The build directory itself
+        content = source.read_bytes()
+        stem = f"{source.stem}.{_fingerprint(content)}"
+        target = output_dir / f"{stem}{source.suffix}"
+        target.write_bytes(content)
+        entry = {"file": target.name}
+        if source.suffix.lower() in COMPRESSED_TYPES:
+            _compress(target)
+        if source.suffix.lower() in IMAGE_TYPES:
+            entry["variants"] = _image_variants(source, output_dir, stem)
+        manifest[source.name] = entry
+
+    # Written last, and replaced in a single step: a running server never reads a manifest of missing files
+    temporary_file = output_dir / f"{MANIFEST_FILE}.tmp"
+    temporary_file.write_text(json.dumps(manifest, indent=2))
+    os.replace(temporary_file, output_dir / MANIFEST_FILE)
+    return manifest
+
+
+def load_manifest() -> dict:
+    """Reads the manifest of the last build (empty if the assets weren't built)."""
+    global _manifest
+    manifest_file = config.root_dir / "static" / BUILD_DIR / MANIFEST_FILE
+    _manifest = json.loads(manifest_file.read_text()) if manifest_file.is_file() else {}
+    return _manifest
+
+
+def _manifest_entry(path: str) -> dict | None:
+    return (_manifest if _manifest is not None else load_manifest()).get(path)
+
+
+# -- Template helpers (registered with jinja2.pass_context by app/routers/frontend.py)
+
+def asset_url(context, path: str, media_type: str | None = None) -> str:
+    """Returns the URL of a static file: its fingerprinted copy if the assets were built, otherwise the file itself.
+
+    With media_type (e.g. "image/webp"), returns the largest variant of that type, if any."""
+    url_for = context["request"].url_for
+    entry = _manifest_entry(path)
+    if entry is None:
+        return str(url_for("static", path=path))
+    variants = [variant for variant in entry.get("variants", []) if variant["type"] == media_type]
+    file = variants[-1]["file"] if variants else entry["file"] # The variants are sorted by width
+    return str(url_for("static", path=f"{BUILD_DIR}/{file}"))
+
+
+def asset_srcset(context, path: str, media_type: str) -> str:
+    """Returns the srcset of the variants of an image with the given media type ("" if there are none)."""
+    url_for = context["request"].url_for
+    entry = _manifest_entry(path) or {}
+    return ", ".join(f"{url_for('static', path=BUILD_DIR + '/' + variant['file'])} {variant['width']}w"
+                     for variant in entry.get("variants", []) if variant["type"] == media_type)
+
+
+# -- Serving
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, *parameters = item.split(";")
+        quality = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0: # q=0 means that the encoding is refused
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that serves the built assets with immutable caching, precompressed when the client accepts it.
+
+    The other static files are revalidated (with their ETag) before every use."""
+
+    async def get_response(self, path: str, scope):
+        if Path(path).parts[:1] != (BUILD_DIR,):
+            response = await super().get_response(path, scope)
+            response.headers.setdefault("cache-control", REVALIDATE_CACHE_CONTROL)
+            return response
+
+        response = None
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        for encoding, suffix in ENCODINGS.items():
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                # The media type is guessed from the name, without the compression suffix (e.g. text/css)
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["content-encoding"] = encoding
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        if response.status_code in (200, 304):
+            response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        response.headers["vary"] = "Accept-Encoding" # The caches keep a copy for each encoding
+        return response
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Builds the fingerprinted, compressed and resized static assets.")
+    parser.add_argument("--clean", action="store_true", help="Deletes the copies of the previous builds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    static_dir = config.root_dir / "static"
+    manifest = build_assets(static_dir, args.clean)
+    variants = sum(len(entry.get("variants", [])) for entry in manifest.values())
+    print(f"Built {len(manifest)} assets and {variants} image variants in {static_dir / BUILD_DIR}"
+          f"{'' if brotli else ' (brotli not installed: gzip only)'}"
+          f"{'' if Image else ' (Pillow not installed: no image variants)'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 
@@ -5,6 +6,90 @@ class _Config:
     def __init__(self):
         self._root_dir: Path = Path("app")
 
+        # -- Database settings
+        # Every setting can be changed from the environment (e.g. APP_ENV=production),
+        # or by assigning the property before the database module is imported.
+
+        self._environment: str = os.environ.get("APP_ENV", "development")
+        self._database_file: Path | None = None
+        if "APP_DATABASE_FILE" in os.environ:
+            self._database_file = Path(os.environ["APP_DATABASE_FILE"])
+        self._sql_echo: bool | None = None # None: decided by the environment
+        if "APP_SQL_ECHO" in os.environ:
+            self._sql_echo = os.environ["APP_SQL_ECHO"].lower() in ("1", "true", "yes")
+
+        self._async_database: bool = os.environ.get("APP_DB_ASYNC", "1").lower() in ("1", "true", "yes")
+        self._pool_class: str = os.environ.get("APP_DB_POOL", "queue") # "queue", "static" or "null"
+        self._pool_size: int = int(os.environ.get("APP_DB_POOL_SIZE", 10))
+        self._pool_max_overflow: int = int(os.environ.get("APP_DB_POOL_MAX_OVERFLOW", 20))
+        self._pool_timeout: float = float(os.environ.get("APP_DB_POOL_TIMEOUT", 30))
+
+        # The routes that only read (see ReadSessionDep in app/data/db.py) use their own pool of read-only
+        # connections, so long reads never take the connections of the writes.
+        self._read_pool: bool = os.environ.get("APP_DB_READ_POOL", "1").lower() in ("1", "true", "yes")
+        self._read_pool_size: int = int(os.environ.get("APP_DB_READ_POOL_SIZE", 10))
+        # Seconds between the copies of the database read by the exports (see app/data/snapshot.py); 0: no copies
+        self._snapshot_interval: float = float(os.environ.get("APP_SNAPSHOT_INTERVAL", 0))
+
+        self._sqlite_pragmas: dict[str, str | int] = {
+            "journal_mode": "WAL", # Readers don't block the writer (and vice versa)
+            "synchronous": "NORMAL", # With WAL, fsync only at checkpoints: safe against app crashes
+            "mmap_size": 256 * 1024 * 1024, # Reads through memory-mapped I/O (256 MB)
+            "cache_size": -64 * 1024, # Negative values are in KB: 64 MB of page cache per connection
+            "temp_store": "MEMORY", # Temporary tables and indexes (e.g. for sorting) stay in memory
+            "busy_timeout": 5000, # Milliseconds a connection waits for a lock before failing
+            "foreign_keys": "ON", # Off by default in SQLite: needed for the ON DELETE CASCADE of the registrations
+        }
+
+        # -- Cache settings (see app/data/cache.py)
+
+        self._cache_enabled: bool = os.environ.get("APP_CACHE", "1").lower() in ("1", "true", "yes")
+        self._cache_max_size: int = int(os.environ.get("APP_CACHE_MAX_SIZE", 10000)) # Entries for each cache
+        self._cache_ttl: float = float(os.environ.get("APP_CACHE_TTL", 60)) # Seconds
+
+        # -- Registration settings
+
+        # True: a registration is checked and inserted by a single INSERT ... SELECT statement.
+        # False: the user, the event and the existing registration are checked by separate queries.
+        self._fast_registration: bool = os.environ.get("APP_FAST_REGISTRATION", "1").lower() in ("1", "true", "yes")
+
+        # With batching, the registrations are written by a single task, committing many of them at once
+        # (see app/data/batching.py): a commit every batch instead of one for each request.
+        self._registration_batching: bool = os.environ.get("APP_REGISTRATION_BATCHING", "0").lower() in ("1", "true", "yes")
+        self._registration_batch_size: int = int(os.environ.get("APP_REGISTRATION_BATCH_SIZE", 200)) # Rows
+        self._registration_batch_interval: float = float(os.environ.get("APP_REGISTRATION_BATCH_INTERVAL_MS", 2)) # Milliseconds
+        self._registration_queue_size: int = int(os.environ.get("APP_REGISTRATION_QUEUE_SIZE", 10000)) # Waiting registrations
+
+        # -- Response settings
+
+        # True: the read routes encode the selected rows straight to JSON (see app/data/serialization.py).
+        # False: FastAPI validates every row again with the response model before encoding it.
+        self._fast_json: bool = os.environ.get("APP_FAST_JSON", "1").lower() in ("1", "true", "yes")
+
+        # True: the event pages are rendered with their data by the server (see app/routers/frontend.py).
+        # False: the server returns the page without data, and the browser loads it from the API.
+        self._server_rendering: bool = os.environ.get("APP_SERVER_RENDERING", "0").lower() in ("1", "true", "yes")
+
+        # -- Change feed settings (see app/data/changes.py)
+
+        self._changes_history_size: int = int(os.environ.get("APP_CHANGES_HISTORY_SIZE", 1000)) # Changes kept to resume from
+        self._changes_buffer_size: int = int(os.environ.get("APP_CHANGES_BUFFER_SIZE", 256)) # Changes queued for each subscriber
+        self._changes_keepalive: float = float(os.environ.get("APP_CHANGES_KEEPALIVE", 15)) # Seconds
+
+        # -- Worker settings (see app/serve.py and app/data/coordination.py)
+
+        # False: the application doesn't create, migrate nor seed the database at startup, because
+        # app.serve already did it once, before starting the workers.
+        self._initialize_database: bool = os.environ.get("APP_DB_INIT", "1").lower() in ("1", "true", "yes")
+        self._worker_sync_interval: float = float(os.environ.get("APP_WORKER_SYNC_INTERVAL", 0.5)) # Seconds
+
+        # -- Instrumentation settings (see app/instrumentation.py)
+
+        self._metrics_enabled: bool = os.environ.get("APP_METRICS", "1").lower() in ("1", "true", "yes")
+        # Counting the rows buffers the result of every query before the route reads it: off by default
+        self._metrics_rows: bool = os.environ.get("APP_METRICS_ROWS", "0").lower() in ("1", "true", "yes")
+        self._profiling_enabled: bool = os.environ.get("APP_PROFILING", "0").lower() in ("1", "true", "yes")
+
     @property
     def root_dir(self) -> Path:
         return self._root_dir
@@ -13,5 +98,260 @@ class _Config:
     def root_dir(self, value: str | Path) -> None:
         self._root_dir = Path(value)
 
+    @property
+    def environment(self) -> str:
+        return self._environment
+
+    @environment.setter
+    def environment(self, value: str) -> None:
+        self._environment = value
+
+    @property
+    def is_production(self) -> bool:
+        return self._environment == "production"
+
+    @property
+    def database_file(self) -> Path:
+        # By default the database is in the data folder, which depends on root_dir
+        return self._database_file or self._root_dir / "data/database.db"
+
+    @database_file.setter
+    def database_file(self, value: str | Path) -> None:
+        self._database_file = Path(value)
+
+    @property
+    def sql_echo(self) -> bool:
+        # Logging every statement is useful while developing, but too slow in production
+        return (not self.is_production) if self._sql_echo is None else self._sql_echo
+
+    @sql_echo.setter
+    def sql_echo(self, value: bool) -> None:
+        self._sql_echo = value
+
+    @property
+    def async_database(self) -> bool:
+        # True: the routes use an AsyncSession on aiosqlite.
+        # False: they use the sync Session, running each statement in the threadpool.
+        return self._async_database
+
+    @async_database.setter
+    def async_database(self, value: bool) -> None:
+        self._async_database = value
+
+    @property
+    def pool_class(self) -> str:
+        return self._pool_class
+
+    @pool_class.setter
+    def pool_class(self, value: str) -> None:
+        if value not in ("queue", "static", "null"):
+            raise ValueError(f"Unknown pool class: {value}")
+        self._pool_class = value
+
+    @property
+    def pool_size(self) -> int:
+        return self._pool_size
+
+    @pool_size.setter
+    def pool_size(self, value: int) -> None:
+        self._pool_size = value
+
+    @property
+    def pool_max_overflow(self) -> int:
+        return self._pool_max_overflow
+
+    @pool_max_overflow.setter
+    def pool_max_overflow(self, value: int) -> None:
+        self._pool_max_overflow = value
+
+    @property
+    def pool_timeout(self) -> float:
+        return self._pool_timeout
+
+    @pool_timeout.setter
+    def pool_timeout(self, value: float) -> None:
+        self._pool_timeout = value
+
+    @property
+    def read_pool(self) -> bool:
+        return self._read_pool
+
+    @read_pool.setter
+    def read_pool(self, value: bool) -> None:
+        self._read_pool = value
+
+    @property
+    def read_pool_size(self) -> int:
+        return self._read_pool_size
+
+    @read_pool_size.setter
+    def read_pool_size(self, value: int) -> None:
+        self._read_pool_size = value
+
+    @property
+    def snapshot_interval(self) -> float:
+        return self._snapshot_interval
+
+    @snapshot_interval.setter
+    def snapshot_interval(self, value: float) -> None:
+        self._snapshot_interval = value
+
+    @property
+    def cache_enabled(self) -> bool:
+        return self._cache_enabled
+
+    @cache_enabled.setter
+    def cache_enabled(self, value: bool) -> None:
+        self._cache_enabled = value
+
+    @property
+    def cache_max_size(self) -> int:
+        return self._cache_max_size
+
+    @cache_max_size.setter
+    def cache_max_size(self, value: int) -> None:
+        self._cache_max_size = value
+
+    @property
+    def cache_ttl(self) -> float:
+        return self._cache_ttl
+
+    @cache_ttl.setter
+    def cache_ttl(self, value: float) -> None:
+        self._cache_ttl = value
+
+    @property
+    def fast_registration(self) -> bool:
+        return self._fast_registration
+
+    @fast_registration.setter
+    def fast_registration(self, value: bool) -> None:
+        self._fast_registration = value
+
+    @property
+    def registration_batching(self) -> bool:
+        return self._registration_batching
+
+    @registration_batching.setter
+    def registration_batching(self, value: bool) -> None:
+        self._registration_batching = value
+
+    @property
+    def registration_batch_size(self) -> int:
+        return self._registration_batch_size
+
+    @registration_batch_size.setter
+    def registration_batch_size(self, value: int) -> None:
+        self._registration_batch_size = value
+
+    @property
+    def registration_batch_interval(self) -> float:
+        # The longest time (in milliseconds) a registration waits for others to fill its batch
+        return self._registration_batch_interval
+
+    @registration_batch_interval.setter
+    def registration_batch_interval(self, value: float) -> None:
+        self._registration_batch_interval = value
+
+    @property
+    def registration_queue_size(self) -> int:
+        # When the queue is full, the new registrations wait for a free place (backpressure)
+        return self._registration_queue_size
+
+    @registration_queue_size.setter
+    def registration_queue_size(self, value: int) -> None:
+        self._registration_queue_size = value
+
+    @property
+    def fast_json(self) -> bool:
+        return self._fast_json
+
+    @fast_json.setter
+    def fast_json(self, value: bool) -> None:
+        self._fast_json = value
+
+    @property
+    def server_rendering(self) -> bool:
+        return self._server_rendering
+
+    @server_rendering.setter
+    def server_rendering(self, value: bool) -> None:
+        self._server_rendering = value
+
+    @property
+    def changes_history_size(self) -> int:
+        return self._changes_history_size
+
+    @changes_history_size.setter
+    def changes_history_size(self, value: int) -> None:
+        self._changes_history_size = value
+
+    @property
+    def changes_buffer_size(self) -> int:
+        # A subscriber with more changes waiting is dropped, and resumes from the history
+        return self._changes_buffer_size
+
+    @changes_buffer_size.setter
+    def changes_buffer_size(self, value: int) -> None:
+        self._changes_buffer_size = value
+
+    @property
+    def changes_keepalive(self) -> float:
+        # Seconds without changes before a comment is sent, so proxies keep the stream open
+        # (and a closed connection is noticed)
+        return self._changes_keepalive
+
+    @changes_keepalive.setter
+    def changes_keepalive(self, value: float) -> None:
+        self._changes_keepalive = value
+
+    @property
+    def initialize_database(self) -> bool:
+        return self._initialize_database
+
+    @initialize_database.setter
+    def initialize_database(self, value: bool) -> None:
+        self._initialize_database = value
+
+    @property
+    def worker_sync_interval(self) -> float:
+        # How often a worker looks for the changes of the other workers without requests (e.g. for /changes)
+        return self._worker_sync_interval
+
+    @worker_sync_interval.setter
+    def worker_sync_interval(self, value: float) -> None:
+        self._worker_sync_interval = value
+
+    @property
+    def metrics_enabled(self) -> bool:
+        return self._metrics_enabled
+
+    @metrics_enabled.setter
+    def metrics_enabled(self, value: bool) -> None:
+        self._metrics_enabled = value
+
+    @property
+    def metrics_rows(self) -> bool:
+        # Also counts the rows returned by the queries of every route
+        return self._metrics_rows
+
+    @metrics_rows.setter
+    def metrics_rows(self, value: bool) -> None:
+        self._metrics_rows = value
+
+    @property
+    def profiling_enabled(self) -> bool:
+        # Anyone could profile a request (slowing it down), so it must be enabled explicitly
+        return self._profiling_enabled
+
+    @profiling_enabled.setter
+    def profiling_enabled(self, value: bool) -> None:
+        self._profiling_enabled = value
+
+    @property
+    def sqlite_pragmas(self) -> dict[str, str | int]:
+        # The returned dict can be changed in place to tune a single pragma
+        return self._sqlite_pragmas
+
 
 config: _Config = _Config()
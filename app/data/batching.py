@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+
+from app.config import config
+from app.data.cache import invalidate_event
+from app.data.changes import change_bus
+from app.data.db import open_async_session
+from app.data.etag import bump_generation
+from app.data.register import REGISTERED_MESSAGE, register_if_valid, registration_error
+from app.models.event import Event
+from app.models.registration import Registration
+from app.models.user import UserPublic
+
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingRegistration:
+    def __init__(self, user: UserPublic, event_id: int, future: asyncio.Future):
+        self.user = user
+        self.event_id = event_id
+        self.future = future # Resolved with the message, or with the exception to raise
+
+
+class RegistrationBatcher:
+    """Writes the registrations with a single task, committing each batch in one transaction.
+
+    Every request still waits for the outcome of its own registration, so the responses don't change:
+    only the commits (and the fsyncs) are shared by the registrations of the same batch."""
+
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._writer: asyncio.Task | None = None
+        self.batches = 0
+        self.registrations = 0 # Registrations written (or rejected) by the batches
+        self.inserted = 0
+        self.failed_batches = 0
+        self.last_batch_size = 0
+        self.max_queue_depth = 0
+        self.flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None
+
+    def start(self) -> None:
+        """Starts the writer task (in the running event loop)."""
+        self._queue = asyncio.Queue(maxsize=config.registration_queue_size)
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Writes the registrations still in the queue, then stops the writer task."""
+        if self._writer is None:
+            return
+        await self._queue.put(None) # Queued after the pending registrations
+        await self._writer
+        self._writer = None
+
+    async def submit(self, user: UserPublic, event_id: int) -> str:
+        """Queues a registration and waits for its batch, returning the message or raising its HTTPException."""
+        if not self.running:
+            raise RuntimeError("The registration batcher isn't running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingRegistration(user, event_id, future))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            pending = await self._queue.get()
+            if pending is None:
+                break
+            batch = [pending]
+            # The batch is written when it's full, or when its first registration waited for the interval
+            deadline = loop.time() + config.registration_batch_interval / 1000
+            while len(batch) < config.registration_batch_size:
+                try:
+                    if self._queue.empty():
+                        pending = await asyncio.wait_for(self._queue.get(), deadline - loop.time())
+                    else:
+                        pending = self._queue.get_nowait() # No need to wait (nor to create a task)
+                except asyncio.TimeoutError:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[_PendingRegistration]) -> None:
+        start = time.perf_counter()
+        errors = []
+        try:
+            async with open_async_session() as session:
+                for pending in batch:
+                    if await register_if_valid(session, pending.user, pending.event_id):
+                        errors.append(None)
+                    else:
+                        errors.append(await registration_error(session, pending.user, pending.event_id))
+                if None in errors: # At least one registration was inserted (and the counter of its event changed)
+                    await bump_generation(session, Registration.__tablename__, Event.__tablename__)
+                await session.commit() # A single commit for the whole batch
+        except Exception as exception:
+            # The transaction was rolled back: every registration of the batch fails with the same error
+            logger.exception("Registration batch of %d rows failed", len(batch))
+            self.failed_batches += 1
+            errors = [exception] * len(batch)
+
+        for pending, error in zip(batch, errors):
+            if error is None:
+                invalidate_event(pending.event_id) # The registered_count changed
+                change_bus.publish(Registration.__tablename__, "created",
+                                   {"username": pending.user.username, "event_id": pending.event_id})
+            if pending.future.done(): # The request was cancelled (e.g. the client disconnected)
+                continue
+            if error is None:
+                pending.future.set_result(REGISTERED_MESSAGE)
+            else:
+                pending.future.set_exception(error)
+
+        self.batches += 1
+        self.registrations += len(batch)
+        self.inserted += errors.count(None)
+        self.last_batch_size = len(batch)
+        self.flush_seconds += time.perf_counter() - start
+
+    def stats(self) -> dict:
+        return {
+            "enabled": config.registration_batching,
+            "running": self.running,
+            "batch_size": config.registration_batch_size,
+            "batch_interval_ms": config.registration_batch_interval,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "registrations": self.registrations,
+            "inserted": self.inserted,
+            "failed_batches": self.failed_batches,
+            "last_batch_size": self.last_batch_size,
+            "flush_seconds": round(self.flush_seconds, 6),
+        }
+
+
+registration_batcher = RegistrationBatcher()
@@ -0,0 +1,79 @@
+import json
+from typing import Annotated
+
+from fastapi import Depends, HTTPException, Request
+from pydantic import ValidationError
+
+from app.models.bulk import BulkResult
+
+
+BULK_CHUNK_SIZE = 500
+# Rows checked and inserted in a single transaction: each chunk costs one query for the duplicate
+# checks, one multi-row insert and one commit, instead of a few statements and a commit per row.
+
+BULK_INSERT_ATTEMPTS = 3
+# A row created by another request between the check and the insert of a chunk makes the insert fail:
+# the chunk is checked and inserted again, at most this many times.
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+BULK_OPENAPI_EXTRA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": {"type": "object"}}},
+            NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "description": "One JSON object per line"}},
+        },
+    }
+}
+# The body is read by read_bulk_body (and not by FastAPI), so we describe it in the OpenAPI schema here.
+
+
+async def read_bulk_body(request: Request) -> list:
+    """Reads the body of a bulk request: a JSON array or NDJSON (one JSON object per line)."""
+    body = await request.body()
+
+    if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        rows = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None) # The row will be reported as invalid, without aborting the others
+        return rows
+
+    try:
+        rows = json.loads(body)
+    except ValueError:
+        rows = None
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="The body must be a JSON array or NDJSON")
+    return rows
+
+
+BulkBodyDep = Annotated[list, Depends(read_bulk_body)]
+
+
+def validate_rows(rows: list, model, results: list) -> list[tuple[int, object]]:
+    """Validates every row against the model.
+
+    The invalid rows are reported in results with a 422, while the valid ones
+    are returned together with their index."""
+    valid_rows = []
+    for index, row in enumerate(rows):
+        try:
+            valid_rows.append((index, model.model_validate(row)))
+        except ValidationError as error:
+            results[index] = BulkResult(
+                index=index, status_code=422,
+                detail="; ".join(f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in error.errors())
+            )
+    return valid_rows
+
+
+def chunks(rows: list, size: int = BULK_CHUNK_SIZE):
+    """Splits the rows in lists of the given size."""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import config
+from app.data.coordination import table_versions
+from app.models.event import Event
+from app.models.registration import Registration
+from app.models.user import User
+
+
+class LRUCache:
+    """Bounded in-process cache: the least recently used entry is evicted when the cache is full,
+    and every entry expires after ttl seconds."""
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict() # key -> (expiration time, value), oldest first
+        self._lock = threading.Lock() # The sync routes run in different threads
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Returns the cached value, or None if the key isn't cached (or is expired)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key) # Now it's the most recently used entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False) # Removes the least recently used entry
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# The cached values are detached copies of the rows, so they can be shared by different sessions.
+# The routes that change the rows invalidate them; the TTL limits how long an entry can stay stale
+# if a read and a write of the same row happen at the same time.
+event_cache = LRUCache("event", config.cache_max_size, config.cache_ttl)
+user_cache = LRUCache("user", config.cache_max_size, config.cache_ttl)
+fragment_cache = LRUCache("fragment", config.cache_max_size, config.cache_ttl)
+# The HTML fragments of the events rendered by the server-side pages (see app/routers/frontend.py),
+# by (event ID, fragment name). They show the registrations too, so they are invalidated with the event.
+EVENT_FRAGMENTS = ("card", "detail")
+
+
+def invalidate_event(id: int) -> None:
+    """Drops the cached copy of the event and its rendered fragments, after a change of the event or of its registrations."""
+    event_cache.invalidate(id)
+    for name in EVENT_FRAGMENTS:
+        fragment_cache.invalidate((id, name))
+
+
+def clear_events() -> None:
+    """Drops every cached event and fragment, after a change of many events."""
+    event_cache.clear()
+    fragment_cache.clear()
+
+
+# When another worker process changes a table, this process can't know which rows changed: every copy is dropped
+table_versions.on_change(Event.__tablename__, clear_events)
+table_versions.on_change(User.__tablename__, user_cache.clear)
+table_versions.on_change(Registration.__tablename__, fragment_cache.clear) # The fragments show the registrations
+
+
+async def get_event(session, id: int) -> Event | None:
+    """Returns the event with the given ID from the cache, reading it from the database on a miss.
+
+    The returned event isn't attached to the session: use session.get to change or delete it."""
+    if not config.cache_enabled:
+        return await session.get(Event, id)
+
+    table_versions.sync() # Drops the events changed by the other workers
+    event = event_cache.get(id)
+    if event is None:
+        event = await session.get(Event, id)
+        if event: # Missing events aren't cached, so creating one doesn't need an invalidation
+            event = Event.model_validate(event) # A copy that isn't bound to the session
+            event_cache.set(id, event)
+    return event
+
+
+async def get_user(session, username: str) -> User | None:
+    """Returns the user with the given username from the cache, reading it from the database on a miss.
+
+    The returned user isn't attached to the session: use session.get to change or delete it."""
+    if not config.cache_enabled:
+        return await session.get(User, username)
+
+    table_versions.sync()
+    user = user_cache.get(username)
+    if user is None:
+        user = await session.get(User, username)
+        if user:
+            user = User.model_validate(user)
+            user_cache.set(username, user)
+    return user
@@ -0,0 +1,120 @@
+import asyncio
+import functools
+import time
+from collections import deque
+
+from app.config import config
+from app.data.coordination import TABLES, table_versions
+
+
+# -- Notes:
+# After every commit, the write routes publish a small change (the table, the action and the key of the row)
+# instead of letting the pages download whole lists again. A null key (or a null field of a registration
+# key) stands for many rows, e.g. a bulk insert or a "delete all": the clients reload those rows.
+# Every subscriber (an open /changes stream) has its own bounded queue: a subscriber that can't keep up is
+# dropped when its queue is full, and resumes from the sequence number of the last change it received,
+# taking the missed changes from the history. If they aren't in the history anymore, it gets a "reset"
+# and reloads everything.
+# The bus lives in the process (and on its event loop), so each worker process publishes its own changes,
+# and only a change without key for the writes of the other workers (see app/data/coordination.py).
+
+class Subscription:
+    """The queue of the changes not yet sent to a single subscriber."""
+
+    def __init__(self, size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.dropped = False # The queue was full: the subscriber must resume from its last change
+
+    async def changes(self, keepalive: float):
+        """Yields the changes as they are published, or None after keepalive seconds without changes.
+
+        Ends when the subscriber is dropped (after the changes already queued) or the bus is closed."""
+        while not (self.dropped and self.queue.empty()):
+            try:
+                change = await asyncio.wait_for(self.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if change is None: # Closed
+                return
+            yield change
+
+
+class ChangeBus:
+    """Publishes the changes of the rows to every subscriber, keeping the latest ones to resume from."""
+
+    def __init__(self, history_size: int, buffer_size: int):
+        # The numbers start from the time of the start, in microseconds: the numbers of a previous run
+        # are lower than the first one of this run, so a client of a previous run gets a reset.
+        self.sequence = time.time_ns() // 1000
+        self.buffer_size = buffer_size
+        self._history: deque = deque(maxlen=history_size)
+        self._subscriptions: set[Subscription] = set()
+        self.published = 0
+        self.dropped = 0
+        self.resets = 0
+
+    def publish(self, table: str, action: str, key=None) -> dict:
+        """Sends a change ("created", "updated" or "deleted") of the row with the given key to every subscriber."""
+        self.sequence += 1
+        change = {"seq": self.sequence, "type": table, "action": action, "id": key}
+        self._history.append(change)
+        self.published += 1
+        for subscription in self._subscriptions:
+            if subscription.dropped:
+                continue
+            try:
+                subscription.queue.put_nowait(change) # Never waits: a slow subscriber doesn't slow down the writes
+            except asyncio.QueueFull:
+                subscription.dropped = True
+                self.dropped += 1
+        return change
+
+    def subscribe(self, after: int | None = None) -> Subscription:
+        """Adds a subscriber, with the changes after the given sequence number already queued.
+
+        If those changes can't be resumed (too old, or of another run), the first change is a "reset"."""
+        missed = []
+        if after is not None and after != self.sequence:
+            missed = [change for change in self._history if change["seq"] > after]
+            # Without the change that follows after, some changes are missing (or after is of another run)
+            if after > self.sequence or not missed or missed[0]["seq"] != after + 1:
+                missed = [{"seq": self.sequence, "type": None, "action": "reset", "id": None}]
+                self.resets += 1
+        # The missed changes don't take the place of the new ones
+        subscription = Subscription(self.buffer_size + len(missed))
+        for change in missed:
+            subscription.queue.put_nowait(change)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def close(self) -> None:
+        """Ends the streams of every subscriber (on shutdown)."""
+        for subscription in self._subscriptions:
+            try:
+                subscription.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                subscription.dropped = True
+        self._subscriptions.clear()
+
+    def stats(self) -> dict:
+        return {
+            "sequence": self.sequence,
+            "subscribers": len(self._subscriptions),
+            "history_size": len(self._history),
+            "max_history_size": self._history.maxlen,
+            "buffer_size": self.buffer_size,
+            "published": self.published,
+            "dropped_subscribers": self.dropped,
+            "resets": self.resets,
+        }
+
+
+change_bus = ChangeBus(config.changes_history_size, config.changes_buffer_size)
+
+# The rows changed by another worker aren't known: the clients reload the whole table
+for _table in TABLES:
+    table_versions.on_change(_table, functools.partial(change_bus.publish, _table, "updated"))
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import mmap
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows: the commits store their generations without the lock
+    fcntl = None
+
+from app.config import config
+
+
+# -- Notes:
+# Every worker process (see app/serve.py) keeps its own caches, so a write made by a worker must also drop
+# the copies kept by the others. The workers share a small memory-mapped file next to the database, with
+# the generation (see app/data/etag.py) of each table: after a commit, the writer stores the new generations
+# there, and every worker compares them with the ones it saw last time before using its caches. This is a
+# read of a few bytes of memory, without queries. When the generation of a table changed, the cached state
+# of that table is dropped (see the listeners in app/data/cache.py and app/data/changes.py).
+# The generations are consecutive, so a worker also knows when the only change was its own commit, which
+# the route already invalidated entry by entry: only the changes of the other workers drop everything.
+# The commits update the counters under a lock on the file, so a counter never goes back: a worker only
+# drops its state when the counter of a table is ahead of the one it saw last time.
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("event", "user", "registration") # The tables with cached state, in the order of their counters
+_COUNTERS = struct.Struct(f"<{len(TABLES)}Q")
+_COUNTER = struct.Struct("<Q")
+
+
+class TableVersions:
+    """The generations of the tables shared by the worker processes, in a memory-mapped file."""
+
+    def __init__(self):
+        self._file = None # Kept open for the lock
+        self._thread_lock = threading.Lock() # flock doesn't exclude the threads of the process (sync sessions)
+        self._memory: mmap.mmap | None = None
+        self._seen: list[int] = [0] * len(TABLES)
+        self._listeners: dict[str, list] = {table: [] for table in TABLES}
+        self._watcher: asyncio.Task | None = None
+        self.external_changes = 0 # Changes of other processes that dropped the local state
+
+    @property
+    def path(self):
+        return config.database_file.with_name(config.database_file.name + "-versions")
+
+    def _open(self) -> mmap.mmap:
+        if self._memory is None:
+            self._file = open(self.path, "a+b") # Created if missing, never truncated
+            with self._locked():
+                if self._file.seek(0, 2) < _COUNTERS.size:
+                    self._file.write(bytes(_COUNTERS.size - self._file.tell()))
+                    self._file.flush()
+            self._memory = mmap.mmap(self._file.fileno(), _COUNTERS.size)
+            self._seen = list(_COUNTERS.unpack_from(self._memory)) # The caches of a new process are empty
+        return self._memory
+
+    @contextmanager
+    def _locked(self):
+        # An exclusive lock on the file, shared by the processes
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def on_change(self, table: str, listener) -> None:
+        """Calls listener() when another process changes the table."""
+        self._listeners[table].append(listener)
+
+    def sync(self) -> None:
+        """Drops the local state of the tables changed by other processes since the last call."""
+        current = _COUNTERS.unpack_from(self._open())
+        if current == tuple(self._seen): # The usual case: nothing to do
+            return
+        for index, table in enumerate(TABLES):
+            if current[index] > self._seen[index]:
+                self._seen[index] = current[index]
+                self.external_changes += 1
+                for listener in self._listeners[table]:
+                    listener()
+
+    def committed(self, generations: dict[str, int]) -> None:
+        """Stores the generations written by a commit of this process, so the other processes see the change."""
+        memory = self._open()
+        with self._locked(): # Two commits can store their generations in any order: the older one is ignored
+            for index, table in enumerate(TABLES):
+                generation = generations.get(table)
+                if generation is None:
+                    continue
+                if self._seen[index] == generation - 1:
+                    # Nobody else changed the table since this process last looked: the route invalidated what it changed
+                    self._seen[index] = generation
+                offset = index * _COUNTER.size
+                if _COUNTER.unpack_from(memory, offset)[0] < generation:
+                    _COUNTER.pack_into(memory, offset, generation)
+
+    def start_watching(self) -> None:
+        """Checks for the changes of the other processes in the background, also without requests."""
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(config.worker_sync_interval)
+            try:
+                self.sync() # E.g. the clients of /changes learn about the changes made by the other workers
+            except Exception:
+                logger.exception("Checking the changes of the other workers failed")
+
+
+table_versions = TableVersions()
@@ -1,134 +1,152 @@
-from sqlmodel import create_engine, SQLModel, Session, select
+from sqlmodel import SQLModel, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Annotated
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 import os
-from faker import Faker
+
+try:
+    import fcntl
+except ImportError: # Windows: start the workers with app.serve, which initializes the database only once
+    fcntl = None
 
 from app.config import config
 from app.models.registration import Registration
 from app.models.user import User
 from app.models.event import Event
+from app.models.generation import Generation
+from app.data.engine import create_db_engine, create_async_db_engine, read_only_url
+from app.instrumentation import instrument_engine
+from app.data.migrations import migrate_database, schema_version, stored_schema_version, store_schema_version
+from app.data.search import create_search_index
 
-sqlite_file_name = config.root_dir / "data/database.db"
+sqlite_file_name = config.database_file
 sqlite_url = f"sqlite:///{sqlite_file_name}"
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args, echo=True)
+engine = create_db_engine(sqlite_url) # Pool, pragmas and logging are configured in app/config.py
+
+# The async engine is created only if it's used, so aiosqlite is needed only in that case
+async_engine = create_async_db_engine(f"sqlite+aiosqlite:///{sqlite_file_name}") if config.async_database else None
+
+# The read-only connections of the routes that only read (see ReadSessionDep): a long read never waits for
+# a connection used by the writes (nor holds one of them), and can't write by mistake.
+if config.read_pool:
+    read_engine = create_db_engine(read_only_url(sqlite_url), read_only=True)
+    async_read_engine = (create_async_db_engine(read_only_url(f"sqlite+aiosqlite:///{sqlite_file_name}"), read_only=True)
+                         if config.async_database else None)
+else:
+    read_engine, async_read_engine = engine, async_engine
+
+# Counts the statements of each request and their duration (see /metrics)
+for _engine in {engine, read_engine}:
+    instrument_engine(_engine)
+for _engine in {async_engine, async_read_engine} - {None}:
+    instrument_engine(_engine.sync_engine)
+
+
+@contextmanager
+def _initialization_lock():
+    # Many workers started together (e.g. by uvicorn --workers) would all find the database missing and seed
+    # it: with the lock, the first one creates it, and the others find it ready.
+    if fcntl is None:
+        yield
+        return
+    with open(f"{sqlite_file_name}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX) # Released when the file is closed
+        yield
 
 
 def init_database() -> None:
-    ds_exists = os.path.isfile(sqlite_file_name)
-    SQLModel.metadata.create_all(engine)
-    if not ds_exists:
-        f = Faker("it_IT")
-        with Session(engine) as session:
-
-            # -- Fake User Data init
-
-            fake_user_list = [] # We'll use this to create fake (but valid) registration data
-
-            # We need the username (and the email, since it would be secondary key) to be unique,
-            # so we track the ones that already come out; if we get a duplicate, we generate
-            # a new value.
-
-            fake_usernames = []
-            fake_emails = []
-
-            for i in range(10):
-                generated_username = f.user_name()
-                while generated_username in fake_usernames:
-                    generated_username = f.user_name()
-
-                generated_email = f.email()
-                while generated_email in fake_emails:
-                    generated_email = f.email()
-
-                user = User(
-                    username=generated_username,
-                    email=generated_email,
-                    name=f.name()
-                )
-                fake_user_list.append(user.username) # Adding the username to the list
-                fake_usernames.append(generated_username)
-                fake_emails.append(generated_email)
-                session.add(user)
-
-            session.commit() # Commits the changes to the db
+    with _initialization_lock():
+        ds_exists = os.path.isfile(sqlite_file_name)
+        version = schema_version(engine)
+        if ds_exists and stored_schema_version(engine) == version:
+            return # Already up to date: the fast start (see the notes in app/data/migrations.py)
+        SQLModel.metadata.create_all(engine)
+        up_to_date = True
+        if ds_exists:
+            # The database may have been created by an older version: the missing columns and indexes are added
+            up_to_date = migrate_database(engine)
+        else:
+            create_search_index(engine) # Before the seed, so the triggers index the new events
+            # A new database is filled with a few fake (but valid) users, events and registrations.
+            # The same generator can build much bigger datasets: see app/data/seed.py.
+            from app.data.seed import seed_database # Imported only when seeding: Faker is slow to import
+            seed_database(engine, users=10, events=10, registrations=10)
+        if up_to_date:
+            store_schema_version(engine, version)
 
-            # -- Fake Event Data init
 
+def get_session():
+    with Session(engine) as session:
+        yield session
 
-            # We check that no duplicate event is created (even though not required by the db structure)
-
-            fake_titles = []
-            fake_descriptions = []
-            fake_locations = []
-            fake_dates = []
 
-            for i in range(10):
+SessionDep = Annotated[Session, Depends(get_session)]
 
-                generated_title = f.sentence(nb_words=5)
-                generated_description = f.sentence(nb_words=20)
-                generated_location = f.address()
-                generated_date = f.date_time()
 
-                # Checks if duplicates
+class ThreadpoolSession:
+    """Wraps a sync Session with the same interface of AsyncSession.
 
-                while generated_title in fake_titles:
-                    generated_title = f.sentence(nb_words=5)
+    Each statement runs in FastAPI's threadpool, so the routes can be the same
+    whether config.async_database is enabled or not."""
 
-                while generated_description in fake_descriptions:
-                    generated_description = f.sentence(nb_words=20)
+    def __init__(self, session: Session):
+        self.sync_session = session
 
-                while generated_location in fake_locations:
-                    generated_location = f.address()
+    async def exec(self, statement, **kwargs):
+        # Like AsyncSession, the rows are fetched before returning, so they can be read without blocking
+        return await run_in_threadpool(self.sync_session.exec, statement,
+                                       execution_options={"prebuffer_rows": True}, **kwargs)
 
-                while generated_date in fake_dates:
-                    generated_date = f.date_time()
+    async def get(self, model, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, model, ident, **kwargs)
 
-                # Appends to the list
+    def add(self, instance) -> None:
+        self.sync_session.add(instance) # Doesn't run any statement (until the next flush)
 
-                fake_titles.append(generated_title)
-                fake_descriptions.append(generated_description)
-                fake_locations.append(generated_location)
-                fake_dates.append(generated_date)
+    async def delete(self, instance) -> None:
+        await run_in_threadpool(self.sync_session.delete, instance)
 
-                event = Event(
-                    title= generated_title,
-                    description= generated_description,
-                    location= generated_location,
-                    date=generated_date
-                )
+    @property
+    def info(self) -> dict:
+        return self.sync_session.info
 
-                session.add(event)
-            session.commit()
+    async def commit(self) -> None:
+        await run_in_threadpool(self.sync_session.commit)
 
-            # -- Fake Registration Data init
+    async def rollback(self) -> None:
+        await run_in_threadpool(self.sync_session.rollback)
 
-            numbers_generated = [] # Empty list to check if a given combination already exists
-            # Since the combination of username and event_id in Registration is primary key of the registration table,
-            # the registrations must be unique; so, we need to check if a given combination already appeared
-            # while initialising the database.
 
-            for i in range(10):
-                # If the combination already exists, then a new combination is generated
-                random_numbers = (f.pyint(0, 9), f.pyint(0, 9))
-                while random_numbers in numbers_generated:
-                    random_numbers = (f.pyint(0, 9), f.pyint(0, 9))
+@asynccontextmanager
+async def open_async_session(read_only: bool = False):
+    """Opens the session used by the routes: also usable outside a request (e.g. by a background task).
 
-                numbers_generated.append(random_numbers) # Once the combination is created, we add it to the list
+    With read_only, the session uses the read-only connections."""
+    if config.async_database:
+        # expire_on_commit=False: reading an attribute after the commit must not run a (blocking) query
+        async with AsyncSession(async_read_engine if read_only else async_engine, expire_on_commit=False) as session:
+            yield session
+    else:
+        session = Session(read_engine if read_only else engine, expire_on_commit=False) # Same as above
+        try:
+            yield ThreadpoolSession(session)
+        finally:
+            await run_in_threadpool(session.close)
 
-                event_registration = Registration(
-                    username=fake_user_list[random_numbers[0]], # Random user in the list
-                    event_id = random_numbers[1] # Random event between the ones created
-                )
-                session.add(event_registration)
-            session.commit()
 
+async def get_async_session():
+    async with open_async_session() as session:
+        yield session
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_read_session():
+    async with open_async_session(read_only=True) as session:
         yield session
 
 
-SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+# With config.async_database disabled the session is a ThreadpoolSession, which has the same interface.
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
+# For the routes that only read: the same session, on the read-only connections.
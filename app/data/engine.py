@@ -0,0 +1,81 @@
+from pathlib import Path
+
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, StaticPool, NullPool
+from sqlmodel import create_engine
+
+from app.config import config
+
+
+def _pool_options(queue_pool_class=QueuePool, pool_class: str | None = None, pool_size: int | None = None) -> dict:
+    # StaticPool shares a single connection, NullPool opens a new one for every session,
+    # QueuePool keeps up to pool_size idle connections (plus max_overflow under load).
+    pool_class = pool_class or config.pool_class
+    if pool_class == "static":
+        return {"poolclass": StaticPool}
+    if pool_class == "null":
+        return {"poolclass": NullPool}
+    if pool_class == "queue":
+        return {
+            "poolclass": queue_pool_class,
+            "pool_size": config.pool_size if pool_size is None else pool_size,
+            "max_overflow": config.pool_max_overflow,
+            "pool_timeout": config.pool_timeout,
+        }
+    raise ValueError(f"Unknown pool class: {pool_class}")
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Applies the pragmas in config.sqlite_pragmas to a new SQLite connection."""
+    # Most pragmas only last as long as the connection, so they are set every time one is opened
+    cursor = dbapi_connection.cursor()
+    for name, value in config.sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+WRITING_PRAGMAS = {"journal_mode"} # Changing them writes to the database: the read-only connections keep them as they are
+
+
+def set_read_only_pragmas(dbapi_connection, connection_record) -> None:
+    """Applies the pragmas in config.sqlite_pragmas to a new read-only connection, which also refuses to write."""
+    cursor = dbapi_connection.cursor()
+    for name, value in config.sqlite_pragmas.items():
+        if name not in WRITING_PRAGMAS:
+            cursor.execute(f"PRAGMA {name}={value}")
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def read_only_url(url: str) -> str:
+    """Returns the URL of a read-only connection to the SQLite database at url (e.g. sqlite:///app/data/database.db)."""
+    driver, _, path = url.partition(":///")
+    return f"{driver}:///file:{Path(path).as_posix()}?mode=ro&uri=true"
+
+
+def create_db_engine(url: str, echo: bool | None = None, read_only: bool = False, pool_class: str | None = None) -> Engine:
+    """Creates an engine for the SQLite database at url, configured as described in app/config.py.
+
+    With read_only, url must open the database read-only (see read_only_url), and the pool has its own size."""
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False}, # The connections are shared by FastAPI's threads
+        echo=config.sql_echo if echo is None else echo,
+        **_pool_options(pool_class=pool_class, pool_size=config.read_pool_size if read_only else None)
+    )
+    event.listen(engine, "connect", set_read_only_pragmas if read_only else set_sqlite_pragmas)
+    return engine
+
+
+def create_async_db_engine(url: str, echo: bool | None = None, read_only: bool = False) -> AsyncEngine:
+    """Creates an async engine (e.g. on sqlite+aiosqlite) with the same settings of create_db_engine."""
+    engine = create_async_engine(
+        url,
+        echo=config.sql_echo if echo is None else echo,
+        # The async engines need the asyncio version of QueuePool
+        **_pool_options(AsyncAdaptedQueuePool, pool_size=config.read_pool_size if read_only else None)
+    )
+    # The events are registered on the sync engine wrapped by the async one
+    event.listen(engine.sync_engine, "connect", set_read_only_pragmas if read_only else set_sqlite_pragmas)
+    return engine
@@ -0,0 +1,112 @@
+import functools
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlmodel import select, text
+
+from app.data.coordination import table_versions
+from app.models.generation import Generation
+
+
+_GENERATIONS_KEY = "generations" # In session.info: the generations written by the transaction
+
+
+@functools.cache
+def _bump_generation_statement(count: int):
+    # Written as text because the SQLite INSERT construct of SQLAlchemy can't be cached: it would be compiled
+    # again by every request that changes something. There is a statement for each number of tables.
+    values = ", ".join(f"(:table_name_{index}, 1)" for index in range(count))
+    return text(
+        f"INSERT INTO generation (table_name, value) VALUES {values} "
+        "ON CONFLICT (table_name) DO UPDATE SET value = value + 1 " # The row of a table is created by its first change
+        "RETURNING table_name, value"
+    )
+
+
+async def bump_generation(session, *table_names: str) -> None:
+    """Increments the generation of the given tables.
+
+    Must be called before the commit of every change, so the counters change in the same transaction."""
+    statement = _bump_generation_statement(len(table_names))
+    result = await session.exec(statement, params={f"table_name_{index}": name for index, name in enumerate(table_names)})
+    # Stored by the commit where the other worker processes can see them (see app/data/coordination.py)
+    session.info.setdefault(_GENERATIONS_KEY, {}).update(result.all())
+
+
+@event.listens_for(Session, "after_commit")
+def _share_generations(session) -> None:
+    generations = session.info.pop(_GENERATIONS_KEY, None)
+    if generations:
+        table_versions.committed(generations)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_generations(session, previous_transaction) -> None:
+    session.info.pop(_GENERATIONS_KEY, None)
+
+
+async def get_generations(session, *table_names: str) -> list[int]:
+    """Returns the generation of each table (0 for the tables that were never changed)."""
+    statement = select(Generation.table_name, Generation.value).where(Generation.table_name.in_(table_names)) # NOQA
+    values = dict((await session.exec(statement)).all())
+    return [values.get(name, 0) for name in table_names]
+
+
+def make_etag(*parts) -> str:
+    """Returns a (quoted) ETag built from the given values."""
+    digest = hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def collection_etag(request: Request, generations: list[int]) -> str:
+    # A list changes when its tables change, but also depends on the query parameters (page, fields...)
+    return make_etag(request.url.path, request.url.query, *generations)
+
+
+def resource_etag(key, updated_at: datetime | None) -> str:
+    return make_etag(key, updated_at.isoformat() if updated_at else "")
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: the W/ prefix is ignored
+    candidates = (candidate.strip().removeprefix("W/") for candidate in if_none_match.split(","))
+    return etag in candidates
+
+
+def not_modified(request: Request, etag: str, last_modified: datetime | None = None) -> Response | None:
+    """Returns a 304 response if the client already has the current version of the resource, otherwise None."""
+    headers = conditional_headers(etag, last_modified)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        return Response(status_code=304, headers=headers) if _etag_matches(if_none_match, etag) else None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return None
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        if last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= since:
+            return Response(status_code=304, headers=headers)
+    return None
+
+
+def conditional_headers(etag: str, last_modified: datetime | None = None) -> dict[str, str]:
+    """Returns the headers to send with a resource, so that the client can revalidate it later."""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache", # The browser can keep the response, but has to revalidate it every time
+    }
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
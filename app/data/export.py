@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select
+
+from app.data.db import read_engine
+from app.data.snapshot import snapshot
+
+
+EXPORT_BATCH_SIZE = 1000 # Rows read from the database (and sent to the client) at a time
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+
+
+def export_media_type(accept: str | None) -> str | None:
+    """Returns the export format requested with the Accept header, or None for a normal JSON response."""
+    if not accept:
+        return None
+
+    for media_type in accept.split(","):
+        media_type = media_type.split(";")[0].strip() # Ignores parameters like ";q=0.9"
+        if media_type in (NDJSON_MEDIA_TYPE, CSV_MEDIA_TYPE):
+            return media_type
+        if media_type == "application/json":
+            return None # JSON was preferred to the export formats
+    return None
+
+
+def _encode_value(value):
+    # Dates are written in the same ISO format used in the JSON responses
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+SNAPSHOT_TIME_HEADER = "X-Snapshot-Time" # When the exported copy of the database was made
+
+
+def _batches(engine, columns: list, keys: list, conditions: list):
+    # The session is opened here (and not taken from the route dependency) because the rows
+    # are read while the response is being sent, after the route function has returned.
+    with Session(engine) as session:
+        statement = select(*columns).where(*conditions).order_by(*keys).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        # With yield_per the rows are fetched from the cursor one batch at a time,
+        # instead of loading the whole table in memory.
+        # execute, not exec: the rows are read by field name, and exec would return bare values (instead of
+        # rows) when a single column is selected, e.g. ?fields=id
+        for batch in session.execute(statement).partitions():
+            yield batch
+
+
+def _ndjson_stream(engine, columns: list, keys: list, conditions: list, fields: list[str]):
+    for batch in _batches(engine, columns, keys, conditions):
+        lines = (
+            json.dumps({field: _encode_value(getattr(row, field)) for field in fields}, ensure_ascii=False)
+            for row in batch
+        )
+        yield "\n".join(lines) + "\n"
+
+
+def _csv_stream(engine, columns: list, keys: list, conditions: list, fields: list[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields) # Header
+
+    for batch in _batches(engine, columns, keys, conditions):
+        writer.writerows([_encode_value(getattr(row, field)) for field in fields] for row in batch)
+        yield buffer.getvalue()
+        # The buffer is emptied after each batch, so it never holds more than one of them
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    if buffer.tell(): # Empty table: only the header was written
+        yield buffer.getvalue()
+
+
+def export_response(media_type: str, columns: list, keys: list, fields: list[str], name: str,
+                    conditions: list = ()) -> StreamingResponse:
+    """Streams every row of the selected columns, sorted by the key columns, in the requested format.
+
+    Only the rows matching the conditions (e.g. the filters of the list) and the given fields are written;
+    name is used for the file name of CSV exports.
+    The rows are read from the copy of the database, if enabled (see app/data/snapshot.py)."""
+    engine = snapshot.engine()
+    headers = {}
+    if engine is None:
+        engine = read_engine # The live database, on the read-only connections
+    else:
+        headers[SNAPSHOT_TIME_HEADER] = snapshot.taken_at().isoformat()
+
+    if media_type == CSV_MEDIA_TYPE:
+        headers["Content-Disposition"] = f'attachment; filename="{name}.csv"'
+        return StreamingResponse(_csv_stream(engine, columns, keys, conditions, fields), media_type=CSV_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(_ndjson_stream(engine, columns, keys, conditions, fields), media_type=NDJSON_MEDIA_TYPE, headers=headers)
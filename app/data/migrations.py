@@ -0,0 +1,223 @@
+import argparse
+import logging
+import zlib
+from pathlib import Path
+
+from sqlalchemy import Engine, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlmodel import SQLModel, Session, select, update, delete, exists, func
+
+from app.config import config
+from app.data.engine import create_db_engine
+from app.data.search import SEARCH_DDL, create_search_index
+from app.models.event import Event, event_fingerprint, utc_now
+from app.models.registration import Registration
+from app.models.user import User
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_CHUNK_SIZE = 10_000
+
+
+# -- Notes:
+# Checking an existing database (create_all, then the missing columns, indexes and foreign keys) reads the
+# whole schema at every start. The version of the schema is stored in the database instead, with
+# PRAGMA user_version: when it matches the version of the models, the database is already up to date and
+# the start skips every check. The version is a checksum of the DDL of the models and of the search index,
+# so any change to them is a new version (and the next start migrates the database as usual).
+
+def schema_version(engine: Engine) -> int:
+    """Returns the version of the schema of the models (a positive 31 bit number, as PRAGMA user_version is signed)."""
+    statements = list(SEARCH_DDL)
+    for table in SQLModel.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=engine.dialect)))
+        statements += [str(CreateIndex(index).compile(dialect=engine.dialect))
+                       for index in sorted(table.indexes, key=lambda index: index.name)]
+    return zlib.crc32("\n".join(statements).encode()) & 0x7FFFFFFF or 1 # 0 is the version of a new database
+
+
+def stored_schema_version(engine: Engine) -> int:
+    """Returns the version of the schema stored in the database (0 if it was never stored)."""
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def store_schema_version(engine: Engine, version: int) -> None:
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version={int(version)}")
+
+
+def _add_missing_columns(engine: Engine) -> set[str]:
+    # create_all only creates the missing tables, so the columns added to the models later
+    # are added to the existing tables here. SQLite can only add nullable columns (or columns
+    # with a default), so the constraints are enforced by the indexes created afterwards.
+    # Returns the added columns, as "table.column".
+    inspector = inspect(engine)
+    added = set()
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                definition = f"{column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    definition += f" DEFAULT {column.server_default.arg}"
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {definition}")
+                logger.info("Added column %s.%s", table.name, column.name)
+                added.add(f"{table.name}.{column.name}")
+    return added
+
+
+def _backfill_event_fingerprints(engine: Engine) -> None:
+    with Session(engine) as session:
+        fingerprints = set(session.exec(select(Event.fingerprint).where(Event.fingerprint != None)).all()) # NOQA
+        while True:
+            events = session.exec(
+                select(Event).where(Event.fingerprint == None).limit(MIGRATION_CHUNK_SIZE) # NOQA
+            ).all()
+            updates = []
+            for event in events:
+                fingerprint = event_fingerprint(event)
+                if fingerprint in fingerprints:
+                    # The database already contains a duplicate of this event: the first one keeps
+                    # the fingerprint (so new duplicates are still rejected), this one gets a different
+                    # value, so the unique index can still be created.
+                    fingerprint = f"duplicate of {fingerprint} ({event.id})"
+                fingerprints.add(fingerprint)
+                updates.append({"id": event.id, "fingerprint": fingerprint})
+            if not updates:
+                break
+            session.exec(update(Event), params=updates) # Bulk update by primary key
+            session.commit()
+
+
+def _backfill_updated_at(engine: Engine) -> None:
+    # The rows created before the updated_at column existed are considered changed now:
+    # the clients revalidate them once and then get their 304 responses as usual.
+    with engine.begin() as connection:
+        for model in (Event, User):
+            connection.execute(update(model).where(model.updated_at == None).values(updated_at=utc_now())) # NOQA
+
+
+def recount_registrations(engine: Engine) -> None:
+    """Sets the registered_count of every event to the number of its registrations."""
+    # A single UPDATE with a correlated COUNT, served by the index on the event_id of the registrations
+    registrations = select(func.count()).select_from(Registration).where(Registration.event_id == Event.id) # NOQA
+    with engine.begin() as connection:
+        connection.execute(update(Event).values(registered_count=registrations.scalar_subquery()))
+
+
+def purge_orphan_registrations(engine: Engine) -> int:
+    """Deletes the registrations of users or events that don't exist anymore, returning how many were deleted.
+
+    Older versions deleted a user (or an event) and its registrations in two transactions, and SQLite didn't
+    enforce the foreign keys, so a crash between them could leave registrations without their user or event."""
+    statement = delete(Registration).where(
+        ~exists().where(User.username == Registration.username) | # NOQA
+        ~exists().where(Event.id == Registration.event_id) # NOQA
+    )
+    with engine.begin() as connection:
+        purged = connection.execute(statement).rowcount
+    if purged:
+        logger.warning("Deleted %d orphan registrations", purged)
+    return purged
+
+
+def _foreign_keys(constraints) -> set[tuple]:
+    return {(tuple(columns), (ondelete or "").upper()) for columns, ondelete in constraints}
+
+
+def _tables_with_changed_foreign_keys(engine: Engine) -> list:
+    inspector = inspect(engine)
+    tables = []
+    for table in SQLModel.metadata.sorted_tables:
+        expected = _foreign_keys((constraint.column_keys, constraint.ondelete)
+                                 for constraint in table.foreign_key_constraints)
+        existing = _foreign_keys((foreign_key["constrained_columns"], foreign_key["options"].get("ondelete"))
+                                 for foreign_key in inspector.get_foreign_keys(table.name))
+        if expected != existing:
+            tables.append(table)
+    return tables
+
+
+def _rebuild_tables(engine: Engine, tables: list) -> None:
+    # SQLite can't change the constraints of an existing table, so the table is created again with the
+    # definition of the model and its rows are copied. The rebuilt tables (the registrations) aren't
+    # referenced by other tables, so renaming them doesn't change any other foreign key.
+    inspector = inspect(engine)
+    with engine.connect() as connection:
+        # The DDL statements don't start a transaction by themselves: the whole rebuild is a single one
+        connection.exec_driver_sql("BEGIN")
+        for table in tables:
+            old_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for index in inspector.get_indexes(table.name):
+                connection.exec_driver_sql(f"DROP INDEX {index['name']}") # The names are used by the new table
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO _old_{table.name}")
+            table.create(connection)
+            columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+            connection.exec_driver_sql(
+                f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM _old_{table.name}"
+            )
+            connection.exec_driver_sql(f"DROP TABLE _old_{table.name}")
+            logger.info("Rebuilt table %s with the new foreign keys", table.name)
+        connection.commit()
+
+
+def _create_missing_indexes(engine: Engine) -> bool:
+    # Returns False if an index couldn't be created
+    created = True
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True) # Does nothing if the index already exists
+            except IntegrityError:
+                # A unique index can't be created if the table already contains duplicates:
+                # the application still works, but the duplicates must be fixed by hand.
+                logger.warning("Index %s not created: table %s contains duplicate values",
+                               index.name, table.name)
+                created = False
+    return created
+
+
+def migrate_database(engine: Engine) -> bool:
+    """Brings a database created by an older version of the application up to date with the models.
+
+    Returns False if something must still be fixed by hand (e.g. duplicates that prevent a unique index)."""
+    added_columns = _add_missing_columns(engine)
+    _backfill_event_fingerprints(engine)
+    _backfill_updated_at(engine)
+    tables = _tables_with_changed_foreign_keys(engine)
+    if tables:
+        # The old tables may contain rows that break the foreign keys (they weren't enforced),
+        # and the new ones would reject them
+        purge_orphan_registrations(engine)
+        _rebuild_tables(engine, tables)
+    if "event.registered_count" in added_columns:
+        recount_registrations(engine) # The counters start from the existing registrations
+    complete = _create_missing_indexes(engine)
+    create_search_index(engine) # Also indexes the existing events
+    return complete
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Brings an existing database up to date, deletes the orphan rows "
+                                                 "and recounts the registrations of the events.")
+    parser.add_argument("--db", type=Path, default=config.database_file,
+                        help="SQLite file to migrate (default: %(default)s)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    engine = create_db_engine(f"sqlite:///{args.db}", echo=False)
+    SQLModel.metadata.create_all(engine)
+    if migrate_database(engine):
+        store_schema_version(engine, schema_version(engine)) # The next start of the application skips the checks
+    # The migration purges the orphans only while rebuilding the tables: here they are always looked for
+    print(f"{purge_orphan_registrations(engine)} orphan registrations deleted from {args.db}")
+    recount_registrations(engine) # Also fixes the counters changed by hand (or by the purge)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, Integer, String
+from sqlmodel import tuple_
+from sqlmodel.sql.expression import SelectOfScalar
+from sqlmodel.sql.sqltypes import AutoString
+
+from app.data.serialization import FastJSONResponse, rows_response
+
+
+DEFAULT_PAGE_SIZE = 100 # Rows returned when the client doesn't ask for a specific page size
+MAX_PAGE_SIZE = 1000 # Upper bound for the "limit" query parameter
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# The token to request the next page is sent back in this header, so that the response body
+# keeps the same format (a plain JSON list) that the frontend already expects.
+
+
+def encode_cursor(*values) -> str:
+    """Encodes the sort key of the last row of a page into an opaque token."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int = 1) -> list:
+    """Decodes a token created by encode_cursor, returning the sort key it contains."""
+    try:
+        padded = token + "=" * (-len(token) % 4) # The padding is stripped when encoding
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError: # Covers both the base64 and the JSON decoding errors
+        values = None
+
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return values
+
+
+UNPAGINATED_LIMIT = 10000
+# Hard cap for the requests that explicitly ask for the whole list (all=true): even in this case
+# a single response can't make a worker load an unbounded number of rows in memory.
+
+
+def parse_fields(fields: str | None, model) -> list[str] | None:
+    """Parses the comma-separated "fields" query parameter, checking it against the fields of the model.
+
+    Returns None if no projection was requested."""
+    if fields is None:
+        return None
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in model.model_fields]
+    if not requested or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid fields: {', '.join(unknown) or fields!r}. "
+                   f"Available fields: {', '.join(model.model_fields)}"
+        )
+
+    # The fields keep the order of the model, and duplicates are ignored
+    return [field for field in model.model_fields if field in requested]
+
+
+def _cursor_value(value):
+    # The dates aren't JSON values: they are stored in the cursor in the ISO format
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _key_value(key, value):
+    # The cursor comes from the client: every value must have the type of its key column, otherwise the
+    # comparison would fail in the database (or silently compare values of different types)
+    if isinstance(key.type, DateTime):
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    elif isinstance(key.type, Integer):
+        # bool is an int for Python, but not a valid key; the bounds are the ones of the SQLite integers
+        if isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63:
+            return value
+    elif isinstance(key.type, (String, AutoString)): # AutoString: the str fields of SQLModel
+        if isinstance(value, str):
+            return value
+    elif isinstance(value, (str, int, float)) and not isinstance(value, bool): # Any other type: a JSON scalar
+        return value
+    raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+async def keyset_page(session, statement, keys: list, after: str | None, limit: int,
+                      descending: bool = False) -> tuple[list, str | None]:
+    """Runs a select statement returning one page of rows, sorted by the given key columns.
+
+    The statement must select the key columns, and the last key must be unique (e.g. the ID) so that
+    every row has its own position. Returns the rows and the cursor of the next page (None if this is the last page)."""
+    order = [key.desc() for key in keys] if descending else keys
+    statement = statement.order_by(*order).limit(limit + 1) # One more row tells us if there is a next page
+
+    if after is not None:
+        # Keyset pagination: the page starts right after the key of the last row of the previous one,
+        # which is a range scan on the index instead of skipping OFFSET rows.
+        values = [_key_value(key, value) for key, value in zip(keys, decode_cursor(after, len(keys)))]
+        if len(keys) == 1:
+            statement = statement.where(keys[0] < values[0] if descending else keys[0] > values[0])
+        elif descending:
+            statement = statement.where(tuple_(*keys) < tuple_(*values))
+        else:
+            statement = statement.where(tuple_(*keys) > tuple_(*values))
+
+    rows = (await session.exec(statement)).all()
+    if isinstance(statement, SelectOfScalar):
+        # A single column (only the key, e.g. ?fields=id): exec returns the values instead of rows
+        rows = [(value,) for value in rows]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        names = list(statement.selected_columns.keys()) # The key columns are found by position
+        next_cursor = encode_cursor(*(_cursor_value(rows[-1][names.index(key.key)]) for key in keys))
+
+    return rows, next_cursor
+
+
+def projected_response(rows, fields: list[str], next_cursor: str | None) -> FastJSONResponse:
+    """Builds the response for a page of rows, encoding them directly (see app/data/serialization.py).
+
+    Used when the client asked only for some fields (the response model can't validate partial objects)
+    and, with config.fast_json, for the whole rows too. The rows must start with the columns of the fields."""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return rows_response(rows, fields, headers)
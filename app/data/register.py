@@ -0,0 +1,80 @@
+from fastapi import HTTPException
+from sqlmodel import select, exists, text, update, or_
+
+from app.models.event import Event
+from app.models.registration import Registration
+from app.models.user import User, UserPublic
+
+
+REGISTERED_MESSAGE = "User successfully registered for this event."
+SOLD_OUT_MESSAGE = "This event is sold out."
+
+# The checks of a registration are done by the INSERT itself: the SELECT returns a row only if the user
+# exists with the same name and email and the event exists with a free seat, and ON CONFLICT DO NOTHING
+# skips an existing registration. Written as text because the SQLite INSERT construct of SQLAlchemy
+# (needed for ON CONFLICT) can't be cached, so it would be compiled again on every registration.
+_REGISTER_IF_VALID = text(
+    "INSERT INTO registration (username, event_id) "
+    "SELECT user.username, event.id FROM user JOIN event ON event.id = :event_id "
+    "WHERE user.username = :username AND user.name = :name AND user.email = :email "
+    "AND (event.capacity IS NULL OR event.registered_count < event.capacity) "
+    "ON CONFLICT DO NOTHING"
+)
+
+
+async def take_seats(session, event_id: int, seats: int = 1) -> bool:
+    """Adds seats to the registered_count of the event, only if they are free. Returns False otherwise.
+
+    The check and the change are a single UPDATE, so two concurrent requests can't take the same seat."""
+    statement = update(Event).where(
+        Event.id == event_id, # NOQA
+        or_(Event.capacity == None, Event.registered_count + seats <= Event.capacity) # NOQA
+    ).values(registered_count=Event.registered_count + seats)
+    return bool((await session.exec(statement)).rowcount)
+
+
+async def release_seats(session, event_id: int, seats: int = 1) -> None:
+    """Removes seats from the registered_count of the event (after deleting its registrations)."""
+    statement = update(Event).where(Event.id == event_id).values( # NOQA
+        registered_count=Event.registered_count - seats
+    )
+    await session.exec(statement)
+
+
+async def register_if_valid(session, user: UserPublic, event_id: int) -> bool:
+    """Inserts the registration if it's valid and takes its seat, returning True if it was inserted.
+
+    Nothing is committed: the caller commits (or rolls back) both the changes."""
+    statement = _REGISTER_IF_VALID.bindparams(
+        username=user.username, name=user.name, email=user.email, event_id=event_id
+    )
+    if not (await session.exec(statement)).rowcount:
+        return False
+    if not await take_seats(session, event_id):
+        # The INSERT checked the free seats in the same (write) transaction, so this can't happen
+        raise RuntimeError(f"Event {event_id} has no free seats after a registration")
+    return True
+
+
+async def registration_error(session, user: UserPublic, event_id: int) -> HTTPException:
+    """Returns the error of a registration that register_if_valid didn't insert.
+
+    A single query finds out why, with the same errors (and order) of the separate checks."""
+    user_name = select(User.name).where(User.username == user.username).scalar_subquery() # NOQA
+    user_email = select(User.email).where(User.username == user.username).scalar_subquery() # NOQA
+    registered = exists().where(Registration.username == user.username, Registration.event_id == event_id) # NOQA
+    statement = select(user_name, user_email, exists().where(Event.id == event_id), registered) # NOQA
+    name, email, event_exists, already_registered = (await session.exec(statement)).one()
+
+    if name is None:
+        return HTTPException(status_code=404, detail="User not found")
+    if (user.name != name) or (user.email != email):
+        return HTTPException(
+            status_code=409, # 409 Conflict
+            detail="Provided user information does not match the registered user data."
+        )
+    if not event_exists:
+        return HTTPException(status_code=404, detail="Event not found")
+    if already_registered:
+        return HTTPException(status_code=409, detail="This user is already registered for the event.") # 409 Conflict
+    return HTTPException(status_code=409, detail=SOLD_OUT_MESSAGE)
@@ -0,0 +1,87 @@
+import re
+
+from fastapi import HTTPException
+from sqlalchemy import Engine, inspect, table, column
+from sqlmodel import select
+
+from app.models.event import Event
+
+
+# -- Notes:
+# The full-text index of the events is an FTS5 table that reads the text from the event table
+# (content='event'), so the text isn't stored twice: only the index is. The triggers below update
+# it in the same statement that changes an event, so every route (and the bulk inserts, the deletes
+# of all the events...) keeps it in sync without any code of its own.
+
+SEARCH_TABLE = "event_fts"
+
+SEARCH_DDL = [
+    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+    "title, description, location, content='event', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON event BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, location) "
+    "VALUES (new.id, new.title, new.description, new.location); END",
+    f"CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON event BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, title, description, location) "
+    "VALUES ('delete', old.id, old.title, old.description, old.location); END",
+    # Only the changes of the indexed columns update the index (not e.g. the registered_count)
+    f"CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF title, description, location ON event BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, title, description, location) "
+    "VALUES ('delete', old.id, old.title, old.description, old.location); "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, location) "
+    "VALUES (new.id, new.title, new.description, new.location); END",
+]
+
+_search_table = table(SEARCH_TABLE, column("rowid"), column(SEARCH_TABLE))
+_WORD = re.compile(r"\w+")
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def create_search_index(engine: Engine) -> None:
+    """Creates the full-text index of the events (and its triggers) if it's missing, indexing the existing events."""
+    if inspect(engine).has_table(SEARCH_TABLE):
+        return
+    with engine.begin() as connection:
+        for statement in SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+        # The events added before the index existed
+        connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def search_condition(query: str):
+    """Returns the WHERE condition selecting the events that contain every word of the query.
+
+    The words are matched as prefixes (e.g. "conf" finds "conference") in the title, description and location."""
+    words = _WORD.findall(query)
+    if not words:
+        raise HTTPException(status_code=400, detail="The search query doesn't contain any word")
+    # Every word is quoted, so the characters with a meaning in the FTS5 syntax (", *, AND, NEAR...) are just text
+    match = " ".join(f'"{word}"*' for word in words)
+    matching_ids = select(_search_table.c.rowid).where(_search_table.c[SEARCH_TABLE].match(match))
+    return Event.id.in_(matching_ids) # NOQA
+
+
+def _next_character(character: str, ignore_case: bool) -> str | None:
+    code = ord(character) + 1
+    if 0xD800 <= code <= 0xDFFF: # The surrogates can't be stored in a string
+        code = 0xE000
+    if ignore_case and ord("A") <= code <= ord("Z"):
+        code = ord("Z") + 1 # NOCASE compares the uppercase letters as lowercase: none of them sorts right after "@"
+    return chr(code) if code <= 0x10FFFF else None
+
+
+def prefix_condition(key, prefix: str, ignore_case: bool = False):
+    """Returns the WHERE condition selecting the values of key that start with prefix.
+
+    The condition is a range (key >= prefix AND key < the next prefix), which SQLite reads from the index of
+    the key: only the matching rows are visited. With ignore_case, key must use the NOCASE collation
+    (which ignores the case of the ASCII letters only), like its index."""
+    if ignore_case:
+        prefix = prefix.translate(_ASCII_LOWER) # The bounds are compared after the same folding of NOCASE
+    condition = key >= prefix
+    # The first string after every string starting with the prefix: the prefix with its last character incremented
+    for length in range(len(prefix), 0, -1):
+        next_character = _next_character(prefix[length - 1], ignore_case)
+        if next_character is not None:
+            return condition & (key < prefix[:length - 1] + next_character)
+    return condition # Only made of the last Unicode character: no upper bound
@@ -0,0 +1,149 @@
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from faker import Faker
+from sqlalchemy import Engine
+from sqlmodel import SQLModel, insert, select, func, Session
+
+from app.config import config
+from app.data.engine import create_db_engine
+from app.data.migrations import recount_registrations
+from app.models.registration import Registration
+from app.models.user import User
+from app.models.event import Event, event_fingerprint
+
+
+SEED_CHUNK_SIZE = 100_000 # Rows inserted in a single transaction
+POOL_SIZE = 1000
+# Generating every value with Faker would take hours for millions of rows, so we generate a pool
+# of realistic values once and combine them, making each row unique with its sequence number.
+
+
+def _permutation(size: int, rng: random.Random):
+    """Returns a function that maps each number in [0, size) to a different number in [0, size).
+
+    i -> (a * i + b) % size is a bijection when a and size are coprime, so we get a
+    pseudo-random order of unique values without keeping track of the ones already used."""
+    a = rng.randrange(1, size) if size > 1 else 1
+    while math.gcd(a, size) != 1:
+        a = rng.randrange(1, size)
+    b = rng.randrange(size)
+    return lambda i: (a * i + b) % size
+
+
+def _insert_in_chunks(engine: Engine, model, rows, total: int) -> None:
+    # Each chunk is a single executemany in its own transaction: one fsync every SEED_CHUNK_SIZE rows.
+    inserted = 0
+    while inserted < total:
+        chunk = [next(rows) for _ in range(min(SEED_CHUNK_SIZE, total - inserted))]
+        with engine.begin() as connection:
+            connection.execute(insert(model), chunk)
+        inserted += len(chunk)
+
+
+def seed_database(engine: Engine, users: int, events: int, registrations: int, seed: int | None = None) -> None:
+    """Fills the (empty) tables with the given number of users, events and registrations.
+
+    The same seed always generates the same data."""
+    if registrations > users * events:
+        raise ValueError("There can't be more registrations than (users x events) combinations")
+
+    with Session(engine) as session:
+        if session.exec(select(func.count()).select_from(User)).one() or \
+                session.exec(select(func.count()).select_from(Event)).one():
+            raise ValueError("The database already contains data: seeding requires empty tables")
+
+    rng = random.Random(seed)
+    f = Faker("it_IT")
+    f.seed_instance(seed)
+
+    # -- Fake User Data
+
+    # The username is unique because it ends with the sequence number (the base never contains "-"),
+    # and the email is unique because it contains the username.
+    # This way the username of the i-th user can be computed again when creating the registrations.
+
+    base_usernames = [f.user_name().replace("-", "") for _ in range(POOL_SIZE)]
+    names = [f.name() for _ in range(POOL_SIZE)]
+    domains = [f.free_email_domain() for _ in range(20)]
+
+    def username(i: int) -> str:
+        return f"{base_usernames[i % POOL_SIZE]}-{i}"
+
+    def user_rows():
+        for i in range(users):
+            generated_username = username(i)
+            yield {
+                "username": generated_username,
+                "name": rng.choice(names),
+                "email": f"{generated_username}@{rng.choice(domains)}",
+            }
+
+    _insert_in_chunks(engine, User, user_rows(), users)
+
+    # -- Fake Event Data
+
+    # Each event gets a different one-hour slot (in a pseudo-random order), so two events
+    # never have the same date and therefore can't be duplicates.
+
+    titles = [f.sentence(nb_words=5) for _ in range(POOL_SIZE)]
+    descriptions = [f.sentence(nb_words=20) for _ in range(POOL_SIZE)]
+    locations = [f.address() for _ in range(POOL_SIZE)]
+    first_date = datetime(2020, 1, 1)
+    date_slot = _permutation(max(events, 1), rng)
+
+    def event_rows():
+        for i in range(events):
+            event = Event(
+                id=i + 1, # The IDs are assigned here, so the registrations can refer to them
+                title=rng.choice(titles),
+                description=rng.choice(descriptions),
+                location=rng.choice(locations),
+                date=first_date + timedelta(hours=date_slot(i), minutes=rng.randrange(60)),
+            )
+            event.fingerprint = event_fingerprint(event)
+            yield event.model_dump(exclude={"updated_at"}) # Left to the column default
+
+    _insert_in_chunks(engine, Event, event_rows(), events)
+
+    # -- Fake Registration Data
+
+    # Every (user, event) combination is numbered from 0 to users * events - 1: taking the numbers
+    # from a permutation guarantees that no combination is used twice.
+
+    combination = _permutation(max(users * events, 1), rng)
+
+    def registration_rows():
+        for i in range(registrations):
+            number = combination(i)
+            yield {"username": username(number // events), "event_id": number % events + 1}
+
+    _insert_in_chunks(engine, Registration, registration_rows(), registrations)
+    recount_registrations(engine) # The registered_count of the events
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fills a database with synthetic users, events and registrations.")
+    parser.add_argument("--db", type=Path, default=config.database_file,
+                        help="SQLite file to create or fill (default: %(default)s)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--events", type=int, default=10)
+    parser.add_argument("--registrations", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the random generator")
+    args = parser.parse_args()
+
+    engine = create_db_engine(f"sqlite:///{args.db}", echo=False)
+    SQLModel.metadata.create_all(engine)
+
+    start = time.perf_counter()
+    seed_database(engine, args.users, args.events, args.registrations, args.seed)
+    print(f"{args.users} users, {args.events} events and {args.registrations} registrations "
+          f"written to {args.db} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
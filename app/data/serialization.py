@@ -0,0 +1,38 @@
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError: # Optional: the serializer of pydantic-core is used instead
+    orjson = None
+
+
+# -- Notes:
+# When a route returns plain values, FastAPI validates each of them again with the response model and then
+# encodes the validated copy. The read routes already select exactly the public columns, so their rows are
+# encoded directly: both orjson and pydantic-core produce the same JSON of FastAPI (ISO dates, null, UTF-8).
+# The routes keep their response_model, so the OpenAPI schema doesn't change.
+
+
+def dumps(content) -> bytes:
+    """Encodes the content (dicts, lists, strings, numbers, dates...) to JSON."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return to_json(content)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded by orjson (if installed) or by pydantic-core, without jsonable_encoder."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def rows_response(rows, fields: list[str], headers: dict | None = None) -> FastJSONResponse:
+    """Builds the JSON list of a page of rows, whose first columns are the given fields (in the same order)."""
+    return FastJSONResponse(content=[dict(zip(fields, row)) for row in rows], headers=headers)
+
+
+def object_response(instance, fields, headers: dict | None = None) -> FastJSONResponse:
+    """Builds the JSON object with the given fields of a single instance (e.g. an Event read from the cache)."""
+    return FastJSONResponse(content={field: getattr(instance, field) for field in fields}, headers=headers)
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import anyio
+
+try:
+    import fcntl
+except ImportError: # Windows: every worker may copy the database (each one into its own temporary file)
+    fcntl = None
+
+from app.config import config
+from app.data.engine import create_db_engine, read_only_url
+
+
+# -- Notes:
+# An export reads a whole table, for as long as the client takes to download it. With
+# config.snapshot_interval, the exports read a copy of the database instead, made with the backup API of
+# SQLite every snapshot_interval seconds: the live database only pays for a fast page-by-page copy.
+# The copy is written to a temporary file and then renamed, so an export never sees half a copy, and the
+# exports already running keep reading the copy they opened. With many workers, a lock file lets a single
+# one copy at a time, and the others find the copy already fresh when they get the lock.
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """A periodic copy of the database, read by the exports."""
+
+    def __init__(self):
+        self._engine = None
+        self._refresher: asyncio.Task | None = None
+        self.refreshes = 0
+        self.last_refresh_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return config.snapshot_interval > 0
+
+    @property
+    def path(self):
+        return config.database_file.with_name(config.database_file.name + "-snapshot")
+
+    def taken_at(self) -> datetime | None:
+        """Returns when the current copy was made (None if there isn't any)."""
+        try:
+            return datetime.fromtimestamp(self.path.stat().st_mtime, timezone.utc)
+        except FileNotFoundError:
+            return None
+
+    def engine(self):
+        """Returns the engine of the copy, or None if the copies are disabled (or the first one isn't ready)."""
+        if not self.enabled or self.taken_at() is None:
+            return None
+        if self._engine is None:
+            # Without a pool: every export opens the latest copy, instead of a connection to a replaced file
+            self._engine = create_db_engine(read_only_url(f"sqlite:///{self.path}"), read_only=True, pool_class="null")
+        return self._engine
+
+    def age(self) -> float | None:
+        """Returns the seconds since the current copy was made (None if there isn't any)."""
+        taken_at = self.taken_at()
+        return (datetime.now(timezone.utc) - taken_at).total_seconds() if taken_at else None
+
+    @contextmanager
+    def _lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # Released when the file is closed
+            yield
+
+    def refresh(self) -> bool:
+        """Copies the database, replacing the previous copy, unless another process just did it.
+
+        Returns True if the database was copied."""
+        with self._lock():
+            age = self.age()
+            if age is not None and age < config.snapshot_interval:
+                return False # Made by another worker while this one waited for the lock
+            self._copy()
+        return True
+
+    def _copy(self) -> None:
+        start = time.perf_counter()
+        # Named after the process: even without the lock, two copies never write into the same file
+        temporary_file = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        source = sqlite3.connect(f"file:{config.database_file.as_posix()}?mode=ro", uri=True)
+        target = sqlite3.connect(temporary_file)
+        try:
+            # In a single step, inside a read transaction: with WAL, the writers go on in the meantime
+            source.backup(target)
+            # A WAL copy would need its -wal and -shm files to be opened read-only
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+            source.close()
+        os.replace(temporary_file, self.path)
+        self.refreshes += 1
+        self.last_refresh_seconds = time.perf_counter() - start
+
+    def start(self) -> None:
+        """Refreshes the copy every config.snapshot_interval seconds, in the background."""
+        if self.enabled:
+            self._refresher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    def stats(self) -> dict:
+        taken_at = self.taken_at()
+        return {
+            "enabled": self.enabled,
+            "taken_at": taken_at.isoformat() if taken_at else None,
+            "refreshes": self.refreshes, # Made by this process
+            "last_refresh_seconds": self.last_refresh_seconds,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            age = self.age()
+            # With many workers, the first one that finds the copy too old makes the new one (see refresh)
+            if age is None or age >= config.snapshot_interval:
+                try:
+                    await anyio.to_thread.run_sync(self.refresh)
+                except Exception:
+                    logger.exception("Copying the database for the exports failed")
+                age = self.age() or 0
+            await asyncio.sleep(max(config.snapshot_interval - age, 0))
+
+
+snapshot = Snapshot()
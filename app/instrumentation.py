@@ -0,0 +1,233 @@
+import cProfile
+import io
+import pstats
+import time
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import Session, ORMExecuteState
+
+from app.config import config
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # Seconds
+PROFILE_HEADER = "x-profile" # "X-Profile: 1" (or ?profile=1) returns the profile of the request
+PROFILE_LINES = 40 # Functions shown in a cProfile report
+
+
+class RequestStats:
+    """SQL statistics of the request being served, collected by the engine and session hooks."""
+
+    def __init__(self, count_rows: bool = False):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.count_rows = count_rows
+        self.rows = 0 # Rows returned by the queries (only with count_rows)
+
+
+class RouteMetrics:
+    """Totals of every request served by a route, exposed on /metrics."""
+
+    def __init__(self):
+        self.requests = 0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS) # Requests faster than each bucket (not cumulative)
+        self.latency_sum = 0.0
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+
+    def observe(self, latency: float, stats: RequestStats) -> None:
+        self.requests += 1
+        self.latency_sum += latency
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_buckets[index] += 1
+                break
+        self.statements += stats.statements
+        self.sql_seconds += stats.sql_seconds
+        self.rows += stats.rows
+
+
+# The stats object is created by the middleware: the hooks find it through the context variable, which is
+# also visible in the threadpool and in the greenlets used by the async engine.
+_current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+route_metrics: dict[tuple[str, str], RouteMetrics] = {} # (method, route path) -> metrics
+
+
+# -- SQL hooks
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _current_request.get() is not None:
+        # A stack, since a statement can run other statements (e.g. the default values of the columns)
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current_request.get()
+    if stats is not None and conn.info.get("query_start_time"):
+        stats.statements += 1
+        stats.sql_seconds += time.perf_counter() - conn.info["query_start_time"].pop()
+
+
+def _count_rows(orm_execute_state: ORMExecuteState):
+    # The cursor hooks run before the rows are fetched, so the rows are counted on the ORM results:
+    # the result is buffered and then replayed. That's a copy of every result (and the end of the streaming
+    # of the results that would be streamed), so it's done only when requested (config.metrics_rows) or
+    # for a profiled request.
+    stats = _current_request.get()
+    if stats is None or not stats.count_rows:
+        return None
+    options = orm_execute_state.execution_options
+    if not orm_execute_state.is_select or options.get("yield_per") or options.get("stream_results"):
+        return None # Writes and streamed results (e.g. the export) are left untouched
+    frozen = orm_execute_state.invoke_statement().freeze()
+    stats.rows += len(frozen.data)
+    return frozen()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Records the number and the duration of the statements run by the engine during a request."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+event.listen(Session, "do_orm_execute", _count_rows) # Every session (also the ones wrapped by AsyncSession)
+
+
+# -- Middleware
+
+def _route_path(scope) -> str:
+    # The path of the route (e.g. /events/{id}) instead of the requested one, to keep a metric for each route
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+
+def _profile_requested(scope) -> bool:
+    if not config.profiling_enabled:
+        return False
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER.encode():
+            return value in (b"1", b"true")
+    return parse_qs(scope.get("query_string", b"").decode()).get("profile", [""])[0] in ("1", "true")
+
+
+class _Profiler:
+    # pyinstrument (if installed) follows the awaits of the request; cProfile records everything that runs
+    # in the event loop thread in the meantime (also the other requests), so it's best used on an idle server.
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled")
+        except ImportError:
+            self._profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        if isinstance(self._profiler, cProfile.Profile):
+            self._profiler.enable()
+        else:
+            self._profiler.start()
+
+    def stop(self) -> str:
+        if isinstance(self._profiler, cProfile.Profile):
+            self._profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self._profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+            return output.getvalue()
+        self._profiler.stop()
+        return self._profiler.output_text(unicode=True)
+
+
+class InstrumentationMiddleware:
+    """Collects the latency and the SQL statistics of every request, and profiles the requests that ask for it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        profiler = _Profiler() if _profile_requested(scope) else None
+        stats = RequestStats(count_rows=config.metrics_rows or profiler is not None)
+        token = _current_request.set(stats)
+        status_code = 500
+        first_byte = None # When a streamed response (e.g. an export or /changes) sent its first part
+
+        async def send_or_discard(message):
+            nonlocal status_code, first_byte
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body" and first_byte is None and message.get("more_body"):
+                first_byte = time.perf_counter()
+            if not profiler: # With the profiler, the response is replaced by the report
+                await send(message)
+
+        start = time.perf_counter()
+        if profiler:
+            profiler.start()
+        try:
+            await self.app(scope, receive, send_or_discard)
+        finally:
+            # A streamed response lasts as long as the client reads it (or stays connected): its latency is
+            # the time to the first byte, so the histogram isn't skewed by the length of the streams
+            latency = (first_byte or time.perf_counter()) - start
+            report = profiler.stop() if profiler else None
+            _current_request.reset(token)
+            key = (scope["method"], _route_path(scope))
+            route_metrics.setdefault(key, RouteMetrics()).observe(latency, stats)
+
+        if profiler:
+            body = (f"{scope['method']} {scope['path']} -> {status_code} in {latency * 1000:.2f} ms\n"
+                    f"SQL: {stats.statements} statements, {stats.sql_seconds * 1000:.2f} ms, "
+                    f"{stats.rows} rows returned\n\n{report}").encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode()),
+                            (b"x-profiled-status", str(status_code).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+
+
+# -- Prometheus text format
+
+def _labels(method: str, route: str, **extra) -> str:
+    values = {"method": method, "route": route, **extra}
+    escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for name, value in values.items()}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def render_metrics() -> str:
+    """Returns the metrics of every route in the Prometheus text exposition format."""
+    lines = [
+        "# HELP app_request_duration_seconds Latency of the requests.",
+        "# TYPE app_request_duration_seconds histogram",
+    ]
+    for (method, route), metrics in sorted(route_metrics.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, metrics.latency_buckets):
+            cumulative += count
+            lines.append(f"app_request_duration_seconds_bucket{_labels(method, route, le=bound)} {cumulative}")
+        lines.append(f"app_request_duration_seconds_bucket{_labels(method, route, le='+Inf')} {metrics.requests}")
+        lines.append(f"app_request_duration_seconds_sum{_labels(method, route)} {metrics.latency_sum}")
+        lines.append(f"app_request_duration_seconds_count{_labels(method, route)} {metrics.requests}")
+
+    # Dividing these counters by the number of requests gives the statements per request:
+    # a route whose statements grow with the size of the response has an N+1 query.
+    counters = [
+        ("app_sql_statements_total", "SQL statements run by the requests.", "statements"),
+        ("app_sql_duration_seconds_total", "Time spent running SQL statements.", "sql_seconds"),
+    ]
+    if config.metrics_rows: # Otherwise the rows aren't counted (except for the profiled requests)
+        counters.append(("app_sql_rows_total", "Rows returned by the SQL queries.", "rows"))
+    for name, description, attribute in counters:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} counter")
+        for (method, route), metrics in sorted(route_metrics.items()):
+            lines.append(f"{name}{_labels(method, route)} {getattr(metrics, attribute)}")
+    return "\n".join(lines) + "\n"
@@ -14,24 +14,40 @@ if Path(__file__).parent == Path(os.getcwd()):
 
 from fastapi import FastAPI
 
-from app.routers import frontend, events, registrations, users
+from app.routers import frontend, events, registrations, users, diagnostics, changes
 
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from app.data.db import init_database
+from app.data.batching import registration_batcher
+from app.data.changes import change_bus
+from app.data.coordination import table_versions
+from app.data.snapshot import snapshot
+from app.instrumentation import InstrumentationMiddleware
+from app.assets import AssetFiles, load_manifest
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # on start
-    init_database()
+    if config.initialize_database: # Otherwise app.serve already did it, once for all the workers
+        init_database()
+    table_versions.start_watching() # The changes made by the other workers (see app/data/coordination.py)
+    snapshot.start() # The copy of the database read by the exports, if enabled (see app/data/snapshot.py)
+    load_manifest() # The assets built by python -m app.assets (see app/assets.py)
+    if config.registration_batching:
+        registration_batcher.start()
     yield
     # on close
+    await registration_batcher.stop() # Writes the registrations still waiting
+    change_bus.close() # Ends the open /changes streams
+    await table_versions.stop_watching()
+    await snapshot.stop()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(InstrumentationMiddleware) # Latency and SQL statistics of every request (see /metrics)
 app.mount(
     "/static",
-    StaticFiles(directory=config.root_dir / "static"),
+    AssetFiles(directory=config.root_dir / "static"), # Immutable caching and precompressed copies of the built assets
     name="static"
 )
 app.include_router(frontend.router)
@@ -39,6 +55,8 @@ app.include_router(frontend.router)
 app.include_router(registrations.router)
 app.include_router(events.router)
 app.include_router(users.router)
+app.include_router(diagnostics.router)
+app.include_router(changes.router)
 
 
 if __name__ == "__main__":
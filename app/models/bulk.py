@@ -0,0 +1,7 @@
+from sqlmodel import SQLModel
+
+
+class BulkResult(SQLModel): # Class used to report the outcome of a single row of a bulk request
+    index: int # Position of the row in the request
+    status_code: int # The status code the row would have received as a single request
+    detail: str
@@ -1,21 +1,58 @@
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
+def utc_now() -> datetime:
+    # The dates are stored without timezone, so we always use UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class EventBase(SQLModel): # Common attributes
     title: str
     description: str
     date: datetime
     location: str
+    capacity: int | None = Field(default=None, ge=0) # Seats of the event (None: no limit)
 
 class Event(EventBase, table=True): # Class for ORM
     id:int = Field(default=None, primary_key=True) # The ID is automatically generated by the DB.
+    fingerprint: str | None = Field(default=None, unique=True, index=True)
+    # Hash of the columns used to detect duplicates (see event_fingerprint): with a unique index on it,
+    # the duplicate check is a single index lookup instead of a four-column scan of the table.
+    updated_at: datetime | None = Field(default=None, sa_column_kwargs={"default": utc_now, "onupdate": utc_now})
+    # Set by SQLAlchemy on every INSERT and UPDATE (also for bulk inserts): used for ETag and Last-Modified.
+    registered_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    # Number of registrations, kept up to date by the routes that add or delete them (see app/data/register.py):
+    # the free seats are known without counting the registrations.
+
+    __table_args__ = (
+        Index("ix_event_date", "date"),
+        # Serves the date range filters and the sorting by date. SQLite appends the ID (the rowid) to
+        # every index entry, so the pages sorted by (date, id) are read in the order of the index.
+        Index("ix_event_title", "title"), # The same for the sorting by title
+        Index("ix_event_location_date", "location", "date"),
+        # Serves the location filter, also together with a date range and the sorting by date
+    )
 
 
 class EventPublic(EventBase): # Class used for showing events
     id:int
+    registered_count: int = 0
 
 
 class EventCreate(EventBase): # Class used to create events
-    pass
\ No newline at end of file
+    pass
+
+
+def event_fingerprint(event: EventBase) -> str:
+    """Returns the hash of title, description, location and date of the event.
+
+    Two events with the same fingerprint are duplicates."""
+    # The date is formatted like SQLite stores it (without the timezone),
+    # so the events read from the database get the same fingerprint.
+    date = event.date.strftime("%Y-%m-%d %H:%M:%S.%f")
+    key = "\x1f".join((event.title, event.description, event.location, date)) # \x1f is the "unit separator"
+    return hashlib.sha256(key.encode()).hexdigest()
@@ -0,0 +1,6 @@
+from sqlmodel import SQLModel, Field
+
+
+class Generation(SQLModel, table=True): # Counts the changes made to each table
+    table_name: str = Field(primary_key=True)
+    value: int = 0 # Incremented by every route that changes the table (see app/data/etag.py)
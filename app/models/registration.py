@@ -1,7 +1,21 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
+from app.models.user import UserPublic
+
 
 class Registration(SQLModel, table=True):
-    username: str = Field(primary_key=True, foreign_key="user.username")
-    event_id: int = Field(primary_key=True, foreign_key="event.id")
-    
\ No newline at end of file
+    username: str = Field(primary_key=True, foreign_key="user.username", ondelete="CASCADE")
+    event_id: int = Field(primary_key=True, foreign_key="event.id", ondelete="CASCADE")
+    # Deleting a user or an event also deletes their registrations, in the same statement
+    # (SQLite enforces the foreign keys only with PRAGMA foreign_keys=ON: see app/config.py).
+
+    __table_args__ = (
+        Index("ix_registration_event_id_username", "event_id", "username"),
+        # The primary key index starts with username, so it can't be used to find the registrations of
+        # an event: this index serves the lookups by event_id, already sorted by username.
+    )
+
+
+class RegistrationPublic(UserPublic): # Class used to show a registration with the data of the registered user
+    event_id: int
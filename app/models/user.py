@@ -1,5 +1,10 @@
+from datetime import datetime
+
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field
 
+from app.models.event import utc_now
+
 class UserBase(SQLModel): # Common attributes
     name: str
     email: str
@@ -8,8 +13,18 @@ class UserBase(SQLModel): # Common attributes
 
 class User(UserBase,table = True): # Class used for ORM
     username: str = Field(primary_key=True) # Overwrites the username field in UserBase
+    email: str = Field(unique=True, index=True) # The email is a secondary key, so it's unique (and indexed)
+    updated_at: datetime | None = Field(default=None, sa_column_kwargs={"default": utc_now, "onupdate": utc_now})
+    # Set by SQLAlchemy on every INSERT and UPDATE: used for ETag and Last-Modified.
+
+    __table_args__ = (
+        # Serve the case-insensitive prefix searches of GET /users?prefix=: the values are sorted ignoring the case
+        # (NOCASE), followed by the username, so a page of results is a range scan of the index, already sorted.
+        Index("ix_user_name_nocase", text("name COLLATE NOCASE"), "username"),
+        Index("ix_user_email_nocase", text("email COLLATE NOCASE"), "username"),
+    )
 
 class UserPublic(UserBase): # Class used to show User data
     pass
 class UserCreate(UserBase): # Class used to create a user, imports everything from class UserBase
-    pass
\ No newline at end of file
+    pass
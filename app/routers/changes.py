@@ -0,0 +1,86 @@
+import asyncio
+
+from fastapi import APIRouter, Header, Query, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from typing import Annotated
+
+from app.config import config
+from app.data.changes import change_bus
+from app.data.serialization import dumps
+
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+RETRY_MILLISECONDS = 1000 # How long a browser waits before reconnecting a closed stream
+
+
+class _EventStreamResponse(StreamingResponse):
+    media_type = "text/event-stream"
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # When the client leaves, the stream is left waiting at its last change: closing it now
+            # (instead of whenever it's garbage collected) removes the subscriber right away.
+            await self.body_iterator.aclose()
+
+
+@router.get("/", response_class=_EventStreamResponse)
+async def get_changes(
+        request: Request,
+        after: Annotated[int | None, Query(description="Sequence number of the last change received")] = None,
+        last_event_id: Annotated[int | None, Header(description="Sent by the browser when it reconnects")] = None
+):
+    """Streams the changes of events, users and registrations as Server-Sent Events."""
+    # The browser resumes from the last change it received, whatever the URL says
+    resume_after = last_event_id if last_event_id is not None else after
+
+    async def stream():
+        subscription = change_bus.subscribe(resume_after)
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            async for change in subscription.changes(config.changes_keepalive):
+                if change is None:
+                    yield ": keep-alive\n\n" # A comment: ignored by the browser
+                else:
+                    yield f"id: {change['seq']}\ndata: {dumps(change).decode()}\n\n"
+            # The subscriber was dropped (or the server is stopping): the browser reconnects with Last-Event-ID
+        finally:
+            change_bus.unsubscribe(subscription)
+
+    return _EventStreamResponse(stream(), headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no", # Sent as they come, also behind nginx
+    })
+
+
+@router.websocket("/ws")
+async def changes_websocket(
+        websocket: WebSocket,
+        after: Annotated[int | None, Query(description="Sequence number of the last change received")] = None
+):
+    """Sends the changes of events, users and registrations as JSON messages (the same of GET /changes)."""
+    await websocket.accept()
+    subscription = change_bus.subscribe(after)
+
+    async def send_changes():
+        async for change in subscription.changes(config.changes_keepalive):
+            if change is not None: # The WebSocket has its own pings
+                await websocket.send_text(dumps(change).decode())
+
+    async def wait_for_close():
+        # The client doesn't send anything: receiving is only needed to notice that it left
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(send_changes()), asyncio.create_task(wait_for_close())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        if tasks[0] in done and tasks[1] not in done and not tasks[0].exception():
+            # Dropped, or the server is stopping: 1013 asks the client to reconnect later (with ?after=)
+            await websocket.close(code=1013)
+    finally:
+        for task in tasks:
+            task.cancel()
+        change_bus.unsubscribe(subscription)
@@ -0,0 +1,56 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.data.batching import registration_batcher
+from app.data.cache import event_cache, user_cache, fragment_cache
+from app.data.changes import change_bus
+from app.data.snapshot import snapshot
+from app.instrumentation import render_metrics
+
+
+router = APIRouter(tags=["diagnostics"])
+
+
+
+@router.get("/cache/stats")
+async def get_cache_stats() -> dict[str, dict[str, int]]:
+    """Returns the counters of the in-process caches (hits, misses, evictions...)."""
+    return {cache.name: cache.stats() for cache in (event_cache, user_cache, fragment_cache)}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> str:
+    """Returns the latency and SQL statistics of every route, in the Prometheus text format."""
+    return render_metrics() + render_batcher_metrics()
+
+
+@router.get("/batching/stats")
+async def get_batching_stats() -> dict[str, bool | int | float]:
+    """Returns the settings and the counters of the registration batch writer."""
+    return registration_batcher.stats()
+
+
+@router.get("/changes/stats")
+async def get_changes_stats() -> dict[str, int]:
+    """Returns the counters of the change feed (subscribers, published changes, dropped subscribers...)."""
+    return change_bus.stats()
+
+
+@router.get("/snapshot/stats")
+async def get_snapshot_stats() -> dict[str, bool | int | float | str | None]:
+    """Returns the state of the copy of the database read by the exports."""
+    return snapshot.stats()
+
+
+def render_batcher_metrics() -> str:
+    stats = registration_batcher.stats()
+    metrics = [
+        ("app_registration_queue_depth", "gauge", "Registrations waiting for their batch.", stats["queue_depth"]),
+        ("app_registration_batches_total", "counter", "Registration batches written.", stats["batches"]),
+        ("app_registration_batch_rows_total", "counter", "Registrations written by the batches.", stats["registrations"]),
+        ("app_registration_batch_seconds_total", "counter", "Time spent writing the batches.", stats["flush_seconds"]),
+    ]
+    lines = []
+    for name, metric_type, description, value in metrics:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
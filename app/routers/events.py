@@ -1,40 +1,133 @@
-from fastapi import APIRouter, Path, HTTPException
-
-from sqlmodel import select,delete
-from typing import Annotated
-
-from app.data.db import SessionDep
-from app.models.event import EventPublic, Event, EventCreate
-from app.models.registration import Registration
+from datetime import datetime
+
+from fastapi import APIRouter, Path, HTTPException, Query, Request, Response, Header
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select, delete, insert, or_
+from typing import Annotated, Literal
+
+from app.config import config
+from app.data.db import AsyncSessionDep, ReadSessionDep
+from app.data.cache import invalidate_event, clear_events, get_event, get_user
+from app.data.changes import change_bus
+from app.data.etag import (bump_generation, get_generations, collection_etag, resource_etag,
+                           not_modified, conditional_headers)
+from app.data.batching import registration_batcher
+from app.data.register import (REGISTERED_MESSAGE, SOLD_OUT_MESSAGE, register_if_valid, registration_error,
+                               take_seats)
+from app.data.bulk import BULK_INSERT_ATTEMPTS, BULK_OPENAPI_EXTRA, BulkBodyDep, validate_rows, chunks
+from app.data.export import export_media_type, export_response
+from app.data.search import search_condition
+from app.data.serialization import object_response
+from app.data.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, UNPAGINATED_LIMIT, NEXT_CURSOR_HEADER,
+                                 keyset_page, parse_fields, projected_response)
+from app.models.event import EventPublic, Event, EventCreate, event_fingerprint
+from app.models.registration import Registration, RegistrationPublic
 from app.models.user import UserPublic, User
+from app.models.bulk import BulkResult
 
 
 router = APIRouter(prefix="/events", tags=["events"])
 
-
-
-@router.get("/")
-def get_events(
-        session: SessionDep
-) -> list[EventPublic]:
-    """Returns the events list."""
-    events = session.exec(select(Event)).all() # Queries all the events in the Event table
-    return events
+# Key columns of each sort order: the ID is always the last one, so every event has its own position
+# (needed by the cursor). A leading "-" sorts in descending order.
+EVENT_SORT_KEYS = {
+    "id": [Event.id],
+    "date": [Event.date, Event.id],
+    "-date": [Event.date, Event.id],
+    "title": [Event.title, Event.id],
+}
+
+
+def _event_filters(available: bool | None, q: str | None, date_from: datetime | None, date_to: datetime | None,
+                   location: str | None) -> list:
+    # The WHERE conditions of the filters of the events list (and of its export)
+    conditions = []
+    if available is not None:
+        # The counter is stored in the event, so the check costs the same for every event (no COUNT)
+        has_free_seats = or_(Event.capacity == None, Event.registered_count < Event.capacity) # NOQA
+        conditions.append(has_free_seats if available else ~has_free_seats)
+    if q is not None:
+        conditions.append(search_condition(q)) # Full-text index, see app/data/search.py
+    if date_from is not None:
+        conditions.append(Event.date >= date_from) # The date filters are a range scan on ix_event_date
+    if date_to is not None:
+        conditions.append(Event.date <= date_to)
+    if location is not None:
+        conditions.append(Event.location == location) # NOQA (an equality on ix_event_location_date)
+    return conditions
+
+
+@router.get("/", response_model=list[EventPublic])
+async def get_events(
+        request: Request,
+        response: Response,
+        session: ReadSessionDep,
+        after: Annotated[str | None, Query(description="Cursor returned in the X-Next-Cursor header")] = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE, description="Maximum number of events")] = DEFAULT_PAGE_SIZE,
+        fields: Annotated[str | None, Query(description="Comma-separated list of the fields to return")] = None,
+        unpaginated: Annotated[bool, Query(alias="all", description=f"Returns up to {UNPAGINATED_LIMIT} events")] = False,
+        available: Annotated[bool | None, Query(description="true: only the events with free seats; false: only the sold out ones")] = None,
+        q: Annotated[str | None, Query(description="Words to search in title, description and location")] = None,
+        date_from: Annotated[datetime | None, Query(alias="from", description="Only the events on or after this date")] = None,
+        date_to: Annotated[datetime | None, Query(alias="to", description="Only the events on or before this date")] = None,
+        location: Annotated[str | None, Query(description="Only the events in this location")] = None,
+        sort: Annotated[Literal["id", "date", "-date", "title"], Query(description="Order of the events")] = "id",
+        accept: Annotated[str | None, Header(description="application/x-ndjson or text/csv to export every event")] = None
+):
+    """Returns the events list, one page at a time (sorted by ID, unless requested otherwise)."""
+    selected_fields = parse_fields(fields, EventPublic)
+    sort_keys = EVENT_SORT_KEYS[sort]
+    columns = [getattr(Event, field) for field in selected_fields or EventPublic.model_fields]
+    for key in sort_keys: # The key columns are always needed to build the cursor
+        if key not in columns:
+            columns.append(key)
+
+    conditions = _event_filters(available, q, date_from, date_to, location)
+
+    export_format = export_media_type(accept)
+    if export_format:
+        # The export streams every event of the list (with the same filters), so the pagination parameters are ignored
+        return export_response(export_format, columns, [Event.id], selected_fields or list(EventPublic.model_fields),
+                               "events", conditions)
+
+    # The generation is read before the events: if a change happens in between, the ETag is older
+    # than the data (so the next request downloads them again) and never the opposite.
+    etag = collection_etag(request, await get_generations(session, Event.__tablename__))
+    cached_response = not_modified(request, etag)
+    if cached_response: # The client already has this page: no query and no serialization
+        return cached_response
+
+    if unpaginated:
+        limit = UNPAGINATED_LIMIT
+
+    statement = select(*columns).where(*conditions)
+    events, next_cursor = await keyset_page(session, statement, sort_keys, after, limit,
+                                            descending=sort.startswith("-"))
+
+    if selected_fields or config.fast_json: # Encoded directly, without validating the rows again
+        projected = projected_response(events, selected_fields or list(EventPublic.model_fields), next_cursor)
+        projected.headers.update(conditional_headers(etag))
+        return projected
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    response.headers.update(conditional_headers(etag))
+    return [EventPublic.model_validate(event) for event in events]
 
 
 @router.post("/")
-def post_event(
+async def post_event(
         new_event: EventCreate,
-        session: SessionDep
+        session: AsyncSessionDep
 ):
     """Adds a new event to the list."""
-    # Before adding an event, we check if a duplicate exists
-    statement = select(Event).where(Event.title == new_event.title,
-                                    Event.description == new_event.description,
-                                    Event.location == new_event.location,
-                                    Event.date == new_event.date)
+    # Before adding an event, we check if a duplicate exists.
+    # Duplicates have the same fingerprint, so the check is a lookup on its unique index.
+    fingerprint = event_fingerprint(new_event)
+    statement = select(Event.id).where(Event.fingerprint == fingerprint)
 
-    duplicated_event = session.exec(statement).first()
+    duplicated_event = (await session.exec(statement)).first()
     # .first() returns the first value of the query or None if no match is found
     
     if duplicated_event:
@@ -43,24 +136,96 @@ def post_event(
             detail = "The event already exists."
         ) # 409 Conflict
 
-    session.add(Event.model_validate(new_event))
+    event = Event.model_validate(new_event, update={"fingerprint": fingerprint})
+    session.add(event)
     # model_validate takes the data from the EventCreate instance and
     # creates an instance of Event, which can be added to the database.
 
-    session.commit()
+    await bump_generation(session, Event.__tablename__) # The list of the events changes
+    try:
+        await session.commit()
+    except IntegrityError:
+        # The same event was added by another request after our check: the unique index rejected it
+        raise HTTPException(status_code=409, detail="The event already exists.")
+    change_bus.publish(Event.__tablename__, "created", event.id) # The ID was assigned by the commit
     return "Event successfully created"
 
 
+@router.post("/bulk", openapi_extra=BULK_OPENAPI_EXTRA)
+async def post_events_bulk(
+        session: AsyncSessionDep,
+        rows: BulkBodyDep
+) -> list[BulkResult]:
+    """Adds many events at once, reporting the outcome of each one."""
+    results: list[BulkResult | None] = [None] * len(rows)
+    valid_events = validate_rows(rows, EventCreate, results)
+    created = False
+
+    for chunk in chunks(valid_events):
+        fingerprints = {index: event_fingerprint(event) for index, event in chunk}
+        for _ in range(BULK_INSERT_ATTEMPTS):
+            new_events = await _check_new_events(session, chunk, fingerprints, results)
+            if not new_events:
+                await session.commit()
+                break
+            try:
+                await session.exec(insert(Event), params=new_events) # A single executemany for the whole chunk
+                await bump_generation(session, Event.__tablename__)
+                await session.commit()
+            except IntegrityError:
+                # Another request created some of these events after the check (the unique index rejected
+                # them): the chunk was rolled back, and the check runs again, finding them
+                await session.rollback()
+                continue
+            created = True
+            break
+        else:
+            # Still rejected after every attempt: the rows of the chunk that weren't already reported are duplicates
+            for index, _ in chunk:
+                if results[index].status_code == 201:
+                    results[index] = BulkResult(index=index, status_code=409, detail="The event already exists.")
+
+    if created:
+        change_bus.publish(Event.__tablename__, "created") # Many events: a single change, without ID
+    return results
+
+
+async def _check_new_events(session, chunk: list, fingerprints: dict, results: list) -> list[dict]:
+    """Checks the events of a chunk, setting their results, and returns the ones to insert."""
+    # A single query (on the unique index) finds which events of the chunk already exist
+    statement = select(Event.fingerprint).where(Event.fingerprint.in_(list(fingerprints.values()))) # NOQA
+    existing_fingerprints = set((await session.exec(statement)).all())
+
+    new_events = []
+    for index, event in chunk:
+        if fingerprints[index] in existing_fingerprints:
+            results[index] = BulkResult(index=index, status_code=409, detail="The event already exists.")
+        else:
+            existing_fingerprints.add(fingerprints[index]) # Rejects the duplicates inside the request, too
+            new_events.append(event.model_dump() | {"fingerprint": fingerprints[index]})
+            results[index] = BulkResult(index=index, status_code=201, detail="Event successfully created")
+    return new_events
+
+
 @router.post("/{id}/register")
-def register_user_to_event(
+async def register_user_to_event(
         user_to_register: UserPublic,
         id: Annotated[int, Path(description="ID of the event to register")],
-        session: SessionDep
+        session: AsyncSessionDep
 ):
     """Registers a user to the event with the specified ID."""
+    if config.registration_batching:
+        # Written (with the same checks of the fast registration) by the batch writer, see app/data/batching.py
+        return await registration_batcher.submit(user_to_register, id)
+    if config.fast_registration:
+        return await _register_in_one_statement(session, user_to_register, id)
+    return await _register_with_checks(session, user_to_register, id)
 
+
+async def _register_with_checks(session, user_to_register: UserPublic, id: int) -> str:
     # First, we check if the parameters (user_to_register, event_to_register_id) are valid
-    valid_user = session.get(User, user_to_register.username)
+    # The user and the event are read through the cache (see app/data/cache.py)
+    valid_user = await get_user(session, user_to_register.username)
     if not valid_user:
         # If the user doesn't exist, we report an error.
         raise HTTPException(status_code=404, detail="User not found")
@@ -73,13 +238,13 @@ def register_user_to_event(
         )
 
     # Now we can check if the event is valid.
-    valid_event = session.get(Event, id)
+    valid_event = await get_event(session, id)
     if not valid_event:
         # If the event doesn't exist, we report an error.
         raise HTTPException(status_code=404, detail="Event not found")
 
     #Then, we check if the registration already exists
-    registration = session.get(Registration, (user_to_register.username, id))
+    registration = await session.get(Registration, (user_to_register.username, id))
     if registration:
         # If the registration already exists, we report an error.
         raise HTTPException(
@@ -87,29 +252,164 @@ def register_user_to_event(
             detail="This user is already registered for the event."
         ) # 409 Conflict
 
+    # Then we take a seat: the check on the capacity and the change of the counter are a single UPDATE,
+    # so two concurrent requests can't both take the last seat.
+    if not await take_seats(session, id):
+        raise HTTPException(status_code=409, detail=SOLD_OUT_MESSAGE) # 409 Conflict
+
     # Now we can add the registration
 
     new_registration = Registration(username=user_to_register.username, event_id=id)
     session.add(new_registration)
-    session.commit()
+    await bump_generation(session, Registration.__tablename__, Event.__tablename__) # The counter of the event changed
+    await session.commit()
+    invalidate_event(id)
+    change_bus.publish(Registration.__tablename__, "created", {"username": user_to_register.username, "event_id": id})
     return "User successfully registered for this event."
 
 
+async def _register_in_one_statement(session, user_to_register: UserPublic, id: int) -> str:
+    # A successful registration is a single statement (plus the commit): see app/data/register.py
+    if await register_if_valid(session, user_to_register, id):
+        await bump_generation(session, Registration.__tablename__, Event.__tablename__) # The counter of the event changed
+        await session.commit()
+        invalidate_event(id)
+        change_bus.publish(Registration.__tablename__, "created", {"username": user_to_register.username, "event_id": id})
+        return REGISTERED_MESSAGE
+    # Nothing was inserted: a single query finds out why
+    raise await registration_error(session, user_to_register, id)
+
+
+@router.get("/{id}/registrations")
+async def get_event_registrations(
+        id: Annotated[int, Path(description="ID of the event")],
+        request: Request,
+        response: Response,
+        session: ReadSessionDep,
+        after: Annotated[str | None, Query(description="Cursor returned in the X-Next-Cursor header")] = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE, description="Maximum number of registrations")] = DEFAULT_PAGE_SIZE
+) -> list[RegistrationPublic]:
+    """Returns the registrations of the event with the specified ID, including the data of each user."""
+    # The page contains registrations and user data, so it changes when either table changes
+    etag = collection_etag(request, await get_generations(session, Registration.__tablename__, User.__tablename__))
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+
+    # A single JOIN gives us both the registrations and the user data, so the frontend doesn't need
+    # to download the whole registration table and then ask for each user separately.
+    statement = (
+        select(User.name, User.email, Registration.username, Registration.event_id) # The fields of RegistrationPublic
+        .join(User, Registration.username == User.username) # NOQA
+        .where(Registration.event_id == id) # NOQA
+    )
+    rows, next_cursor = await keyset_page(session, statement, [Registration.username], after, limit)
+
+    if not rows and after is None:
+        # An empty first page may also mean that the event doesn't exist: only in this case
+        # we need a second query to tell the two situations apart.
+        if not await get_event(session, id):
+            raise HTTPException(status_code=404, detail="Event not found")
+
+    if config.fast_json:
+        page = projected_response(rows, list(RegistrationPublic.model_fields), next_cursor)
+        page.headers.update(conditional_headers(etag))
+        return page
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    response.headers.update(conditional_headers(etag))
+
+    return [RegistrationPublic.model_validate(row) for row in rows]
+
+
+@router.post("/{id}/register/bulk", openapi_extra=BULK_OPENAPI_EXTRA)
+async def register_users_to_event_bulk(
+        id: Annotated[int, Path(description="ID of the event to register")],
+        session: AsyncSessionDep,
+        rows: BulkBodyDep
+) -> list[BulkResult]:
+    """Registers many users to the event with the specified ID, reporting the outcome of each one."""
+    if not await get_event(session, id):
+        # Without the event, every registration fails in the same way
+        raise HTTPException(status_code=404, detail="Event not found")
+
+    results: list[BulkResult | None] = [None] * len(rows)
+    valid_users = validate_rows(rows, UserPublic, results)
+
+    for chunk in chunks(valid_users):
+        usernames = [user.username for _, user in chunk]
+
+        # Two queries for the whole chunk: the registered users and their existing registrations
+        statement = select(User.username, User.name, User.email).where(User.username.in_(usernames)) # NOQA
+        registered_users = {user.username: user for user in (await session.exec(statement)).all()}
+
+        statement = select(Registration.username).where(Registration.event_id == id, # NOQA
+                                                        Registration.username.in_(usernames)) # NOQA
+        registered_usernames = set((await session.exec(statement)).all())
+
+        new_registrations = []
+        for index, user in chunk:
+            # The checks are the same of register_user_to_event, in the same order
+            valid_user = registered_users.get(user.username)
+            if not valid_user:
+                results[index] = BulkResult(index=index, status_code=404, detail="User not found")
+            elif (user.name != valid_user.name) or (user.email != valid_user.email):
+                results[index] = BulkResult(
+                    index=index, status_code=409,
+                    detail="Provided user information does not match the registered user data."
+                )
+            elif user.username in registered_usernames:
+                results[index] = BulkResult(
+                    index=index, status_code=409, detail="This user is already registered for the event."
+                )
+            else:
+                registered_usernames.add(user.username) # Rejects the duplicates inside the request, too
+                new_registrations.append((index, {"username": user.username, "event_id": id}))
+
+        while new_registrations:
+            # The registrations that don't fit in the free seats are rejected, in the order of the request
+            capacity, registered_count = (await session.exec(
+                select(Event.capacity, Event.registered_count).where(Event.id == id) # NOQA
+            )).one()
+            if capacity is not None:
+                for index, _ in new_registrations[max(capacity - registered_count, 0):]:
+                    results[index] = BulkResult(index=index, status_code=409, detail=SOLD_OUT_MESSAGE)
+                new_registrations = new_registrations[:max(capacity - registered_count, 0)]
+            # The conditional UPDATE guarantees that the seats are still free, whatever happened after the query:
+            # if another request took some of them in the meantime, the free seats are read again
+            if not new_registrations or await take_seats(session, id, len(new_registrations)):
+                break
+
+        if new_registrations:
+            # A single executemany for the whole chunk
+            await session.exec(insert(Registration), params=[registration for _, registration in new_registrations])
+            await bump_generation(session, Registration.__tablename__, Event.__tablename__)
+            for index, _ in new_registrations:
+                results[index] = BulkResult(
+                    index=index, status_code=201, detail="User successfully registered for this event."
+                )
+        await session.commit()
+        if new_registrations: # Many registrations of the event: a single change, without username
+            invalidate_event(id)
+            change_bus.publish(Registration.__tablename__, "created", {"username": None, "event_id": id})
+
+    return results
+
+
 @router.delete("/")
-def delete_events(
-        session: SessionDep
+async def delete_events(
+        session: AsyncSessionDep
 ):
     """Deletes all events from the list."""
-    session.exec(delete(Event))
+    await session.exec(delete(Event))
     # Since we don't have a "WHERE" condition in the statement, the database
     # deletes all rows in the "event" table.
-    session.commit()
-
-    # Since we deleted all the events,
-    # We need to cancel all the registrations too.
-
-    session.exec(delete(Registration))
-    session.commit()
+    # The registrations are deleted by the database too (ON DELETE CASCADE), in the same transaction.
+    await bump_generation(session, Event.__tablename__, Registration.__tablename__)
+    await session.commit()
+    clear_events()
+    change_bus.publish(Event.__tablename__, "deleted") # With their registrations
     # We chose to cancel and confirm the table even if it's empty, in order to avoid
     # a misunderstanding by the user that might think that an error prevented them
     # to cancel the events.
@@ -118,23 +418,32 @@ def delete_events(
 
 
 @router.get("/{id}")
-def get_event_by_id(
+async def get_event_by_id(
         id: Annotated[int, Path(description="ID of the event to search")],
-        session: SessionDep
+        request: Request,
+        response: Response,
+        session: AsyncSessionDep
 ) -> EventPublic:
     """Returns the event by id."""
-    event = session.get(Event, id) # Event is the table, id is the PK.
+    event = await get_event(session, id) # Event is the table, id is the PK (read through the cache).
     if event: # If the event is found, we return it; otherwise we return error code 404.
+        etag = resource_etag(id, event.updated_at)
+        cached_response = not_modified(request, etag, event.updated_at)
+        if cached_response:
+            return cached_response
+        if config.fast_json:
+            return object_response(event, EventPublic.model_fields, conditional_headers(etag, event.updated_at))
+        response.headers.update(conditional_headers(etag, event.updated_at))
         return event
     else:
         raise HTTPException(status_code=404, detail="Event not found")
 
 
 @router.put("/{id}")
-def update_event(
+async def update_event(
         id: Annotated[int, Path(description="ID of the event to update")],
         new_event: EventCreate,
-        session: SessionDep
+        session: AsyncSessionDep
 ):
     """Updates the event with the specified ID."""
     # -- Notes:
@@ -143,19 +452,18 @@ def update_event(
     # leaving the web app with the opportunity to add a new feature
     # to send an e-mail to users, notifying them about the update.
 
-    event_to_update = session.get(Event, id) # Queries for the corresponding event
+    event_to_update = await session.get(Event, id) # Queries for the corresponding event
     if event_to_update: # If it's found, then the event is updated with the new_event info and then added to db
 
         # Note: this code is the same in post_event, but removing duplication involves
         #       too much abstraction and risks of circular imports,
         #       so it's better to leave it as it is.
 
-        statement = select(Event).where(Event.title == new_event.title,
-                                        Event.description == new_event.description,
-                                        Event.location == new_event.location,
-                                        Event.date == new_event.date)
+        fingerprint = event_fingerprint(new_event)
+        # The event itself isn't a duplicate: e.g. an update of the capacity alone keeps the same fingerprint
+        statement = select(Event.id).where(Event.fingerprint == fingerprint, Event.id != id) # NOQA
 
-        duplicated_event = session.exec(statement).first()
+        duplicated_event = (await session.exec(statement)).first()
         # .first() returns the first value of the query or None if no match is found
 
         if duplicated_event:
@@ -168,12 +476,21 @@ def update_event(
         event_to_update.description = new_event.description
         event_to_update.date = new_event.date
         event_to_update.location = new_event.location
+        event_to_update.capacity = new_event.capacity # Can be lower than registered_count: no new registrations
+        event_to_update.fingerprint = fingerprint
 
         # Note: the use of model_validate is not necessary, since we are adding a valid "Event" instance to the DB
         # (it already has an ID).
 
         session.add(event_to_update) # Adds the updated event to the db (with the corresponding ID)
-        session.commit() # Confirms the changes
+        await bump_generation(session, Event.__tablename__)
+        try:
+            await session.commit() # Confirms the changes
+        except IntegrityError:
+            # Another request created the same event after our check
+            raise HTTPException(status_code=409, detail="This event already exists.")
+        invalidate_event(id) # The cached copy is outdated now
+        change_bus.publish(Event.__tablename__, "updated", id)
         return "Event successfully updated"
 
     else: # Else, a 404 is returned.
@@ -181,9 +498,9 @@ def update_event(
 
 
 @router.delete("/{id}")
-def delete_event(
+async def delete_event(
         id: Annotated[int, Path(description="ID of the event to delete")],
-        session: SessionDep
+        session: AsyncSessionDep
 ):
     """Deletes the event with the specified ID."""
     # Here, we chose to check if an event with the specified ID exists, since when we delete
@@ -191,16 +508,15 @@ def delete_event(
     # to erase it); on the other hand, we would like to know if we are deleting an event that
     # existed previously or not, thus requiring a check.
 
-    event_to_delete = session.get(Event, id)
-    if event_to_delete: # If an event is found, then we delete it
-        session.delete(event_to_delete)
-        session.commit()
-
-        # Now, we need to cancel every registration for the given event.
-        statement = delete(Registration).where(Registration.event_id == id) # NOQA
-        # With NOQA, we are disabling warnings that are known bugs in type checks with SQLAlchemy (safe to ignore)
-        session.exec(statement)
-        session.commit()
+    # The check is the number of deleted rows, so a single statement both checks and deletes the event.
+    statement = delete(Event).where(Event.id == id) # NOQA
+    # With NOQA, we are disabling warnings that are known bugs in type checks with SQLAlchemy (safe to ignore)
+    result = await session.exec(statement)
+    if result.rowcount: # If an event was found, it's deleted together with its registrations (ON DELETE CASCADE)
+        await bump_generation(session, Event.__tablename__, Registration.__tablename__)
+        await session.commit()
+        invalidate_event(id)
+        change_bus.publish(Event.__tablename__, "deleted", id) # With its registrations
         return "Event successfully deleted"
     else: # Else return a 404.
         raise HTTPException(status_code=404, detail="Event not found")
@@ -1,36 +1,127 @@
+import functools
+
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from sqlmodel import select
+
 from app.config import config
+from app.assets import asset_url, asset_srcset
+from app.data.db import ReadSessionDep
+from app.data.cache import fragment_cache, get_event
+from app.data.coordination import table_versions
+from app.data.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page
+from app.models.event import Event, EventPublic
+from app.models.registration import Registration
+from app.models.user import User
 
 router = APIRouter()
-templates = Jinja2Templates(directory=config.root_dir / "templates")
+
+
+@functools.cache
+def _templates():
+    # Set up by the first page, not at the start: the API alone never imports Jinja2
+    from fastapi.templating import Jinja2Templates
+    from jinja2 import pass_context
+
+    templates = Jinja2Templates(directory=config.root_dir / "templates")
+    # Links to the built assets (the helpers read the request from the context of the template)
+    templates.env.globals.update(asset_url=pass_context(asset_url), asset_srcset=pass_context(asset_srcset))
+    return templates
+
+
+# -- Notes:
+# With config.server_rendering, the event pages are sent with their data already rendered, instead of
+# an empty page that loads the data with its own API calls. The HTML of every event (its card in the list,
+# its details and registrations) is cached in fragment_cache, and invalidated by the routes that change the
+# event or its registrations (see invalidate_event in app/data/cache.py): a page of cached events costs a
+# single query, and the details of a cached event none at all.
+
+def _cached_fragment(event_id: int, name: str):
+    if not config.cache_enabled:
+        return None
+    table_versions.sync() # Drops the fragments changed by the other workers
+    return fragment_cache.get((event_id, name))
+
+
+def _cache_fragment(event_id: int, name: str, fragment) -> None:
+    if config.cache_enabled:
+        fragment_cache.set((event_id, name), fragment)
+
+
+def _event_card(event) -> str:
+    card = _cached_fragment(event.id, "card")
+    if card is None:
+        card = _templates().get_template("fragments/event_card.html").render(event=event)
+        _cache_fragment(event.id, "card", card)
+    return card
+
+
+async def _event_detail(session, id: int) -> dict | None:
+    # The event (for the update form), its rendered details and the first page of its registrations
+    detail = _cached_fragment(id, "detail")
+    if detail is None:
+        event = await get_event(session, id)
+        if not event:
+            return None
+        statement = (
+            select(User.name, User.email, Registration.username, Registration.event_id)
+            .join(User, Registration.username == User.username) # NOQA
+            .where(Registration.event_id == id) # NOQA
+        )
+        registrations, next_cursor = await keyset_page(session, statement, [Registration.username], None, DEFAULT_PAGE_SIZE)
+        detail = {
+            "event": event,
+            "details_html": Markup(_templates().get_template("fragments/event_details.html").render(event=event)),
+            "registrations_html": Markup(_templates().get_template("fragments/event_registrations.html").render(
+                registrations=registrations
+            )),
+            "next_cursor": next_cursor,
+        }
+        _cache_fragment(id, "detail", detail)
+    return detail
 
 
 @router.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    return templates.TemplateResponse(
+    return _templates().TemplateResponse(
         request=request, name="home.html",
     )
 
 
 @router.get("/events_list", response_class=HTMLResponse)
-async def events_list(request: Request):
-    return templates.TemplateResponse(
-        request=request, name="events.html",
+async def events_list(request: Request, session: ReadSessionDep):
+    context = {}
+    if config.server_rendering:
+        # The first page that the browser would load (GET /events?limit=1000), with a single query:
+        # the events are still read, to know which ones exist, but their cards come from the cache.
+        columns = [getattr(Event, field) for field in EventPublic.model_fields]
+        events, next_cursor = await keyset_page(session, select(*columns), [Event.id], None, MAX_PAGE_SIZE)
+        context = {
+            "server_rendered": True,
+            "events_html": Markup("".join(_event_card(event) for event in events)),
+            "next_cursor": next_cursor, # The following pages are loaded by the browser ("Load more")
+        }
+    return _templates().TemplateResponse(
+        request=request, name="events.html", context=context,
     )
 
 
 @router.get("/event_detail/{id}", response_class=HTMLResponse)
-async def event_detail(request: Request, id: int):
-    return templates.TemplateResponse(
+async def event_detail(request: Request, id: int, session: ReadSessionDep):
+    context = {"event_id": id}
+    if config.server_rendering:
+        detail = await _event_detail(session, id)
+        context["server_rendered"] = detail is not None # Without the event, the page shows the error as before
+        context.update(detail or {})
+    return _templates().TemplateResponse(
         request=request, name="event_detail.html",
-        context={"event_id": id},
+        context=context,
     )
 
 
 @router.get("/users_list", response_class=HTMLResponse)
 async def users_list(request: Request):
-    return templates.TemplateResponse(
+    return _templates().TemplateResponse(
         request=request, name="users.html"
     )
@@ -1,35 +1,80 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Request, Response, Header
 
 from sqlmodel import select, delete
 from typing import Annotated
 
-from app.data.db import SessionDep
-from app.models.registration import Registration
+from app.config import config
+from app.data.db import AsyncSessionDep, ReadSessionDep
+from app.data.cache import invalidate_event, get_event, get_user
+from app.data.changes import change_bus
+from app.data.register import release_seats
+from app.data.etag import bump_generation, get_generations, collection_etag, not_modified, conditional_headers
+from app.data.export import export_media_type, export_response
+from app.data.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, UNPAGINATED_LIMIT, NEXT_CURSOR_HEADER,
+                                 keyset_page, parse_fields, projected_response)
 from app.models.event import Event
-from app.models.user import User
+from app.models.registration import Registration
 
 
 router= APIRouter(prefix="/registrations", tags=["/registrations"])
 
 
 
-@router.get("/")
-def get_all_registrations(session: SessionDep) -> list[Registration]:
-    """Returns all registrations."""
-    # Queries the database to get all the registrations
-    registrations = session.exec(select(Registration)).all()
-    return registrations
+@router.get("/", response_model=list[Registration])
+async def get_all_registrations(
+        request: Request,
+        response: Response,
+        session: ReadSessionDep,
+        after: Annotated[str | None, Query(description="Cursor returned in the X-Next-Cursor header")] = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE, description="Maximum number of registrations")] = DEFAULT_PAGE_SIZE,
+        fields: Annotated[str | None, Query(description="Comma-separated list of the fields to return")] = None,
+        unpaginated: Annotated[bool, Query(alias="all", description=f"Returns up to {UNPAGINATED_LIMIT} registrations")] = False,
+        accept: Annotated[str | None, Header(description="application/x-ndjson or text/csv to export every registration")] = None
+):
+    """Returns all registrations, one page at a time (sorted by username and event ID)."""
+    selected_fields = parse_fields(fields, Registration)
+
+    export_format = export_media_type(accept)
+    if export_format:
+        # The export streams the whole table, so the pagination parameters are ignored
+        keys = [Registration.username, Registration.event_id]
+        return export_response(export_format, keys, keys, selected_fields or list(Registration.model_fields), "registrations")
+
+    etag = collection_etag(request, await get_generations(session, Registration.__tablename__))
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+
+    if unpaginated:
+        limit = UNPAGINATED_LIMIT
+
+    # Both the columns are part of the primary key, so they are always selected to build the cursor
+    # (after the requested fields, which are encoded from the first columns of the rows)
+    keys = [Registration.username, Registration.event_id]
+    columns = [getattr(Registration, field) for field in selected_fields or Registration.model_fields]
+    columns += [key for key in keys if key not in columns]
+    registrations, next_cursor = await keyset_page(session, select(*columns), keys, after, limit)
+
+    if selected_fields or config.fast_json: # Encoded directly, without validating the rows again
+        projected = projected_response(registrations, selected_fields or list(Registration.model_fields), next_cursor)
+        projected.headers.update(conditional_headers(etag))
+        return projected
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    response.headers.update(conditional_headers(etag))
+    return [Registration.model_validate(registration) for registration in registrations]
 
 
 @router.delete("/")
-def delete_registration(
+async def delete_registration(
         username: Annotated[str, Query(description="The Username of the User to check")],
         event_id: Annotated[int, Query(description="The ID of the Event to check")],
-        session: SessionDep
+        session: AsyncSessionDep
 ) -> str:
     """Deletes a registration."""
-    user_registered = session.get(User, username)
-    event_registered = session.get(Event, event_id)
+    user_registered = await get_user(session, username) # Both read through the cache
+    event_registered = await get_event(session, event_id)
 
     # Checks if the user and event exist; if not, raise an exception
 
@@ -38,17 +83,19 @@ def delete_registration(
     if not event_registered:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    # Checks if the registration exists; if not, raise an exception
-    registration_to_cancel = session.get(Registration, (username, event_id))
-
-    if not registration_to_cancel:
-        raise HTTPException(status_code=404, detail="Registration not found")
-
     statement = delete(Registration).where(Registration.username == username, # NOQA
                                            Registration.event_id == event_id)  # NOQA
     # NOQA disables a warning caused by a known type check bug in SQLAlchemy
 
-    session.exec(statement)
-    session.commit()
+    # The DELETE itself tells if the registration existed: with a separate check, two concurrent
+    # deletes of the same registration would both succeed, and both release its seat
+    if not (await session.exec(statement)).rowcount:
+        await session.rollback()
+        raise HTTPException(status_code=404, detail="Registration not found")
+    await release_seats(session, event_id) # The event has a free seat again
+    await bump_generation(session, Registration.__tablename__, Event.__tablename__)
+    await session.commit()
+    invalidate_event(event_id)
+    change_bus.publish(Registration.__tablename__, "deleted", {"username": username, "event_id": event_id})
     return "Registration deleted successfully"
 
@@ -1,99 +1,256 @@
-from fastapi import APIRouter, Path, HTTPException
+from fastapi import APIRouter, Path, HTTPException, Query, Request, Response, Header
 
-from sqlmodel import select,delete
-from typing import Annotated
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select, delete, insert, update, or_
+from typing import Annotated, Literal
 
-from app.data.db import SessionDep
+from app.config import config
+from app.data.db import AsyncSessionDep, ReadSessionDep
+from app.data.cache import invalidate_event, clear_events, user_cache, get_user
+from app.data.changes import change_bus
+from app.data.etag import (bump_generation, get_generations, collection_etag, resource_etag,
+                           not_modified, conditional_headers)
+from app.data.bulk import BULK_INSERT_ATTEMPTS, BULK_OPENAPI_EXTRA, BulkBodyDep, validate_rows, chunks
+from app.data.export import export_media_type, export_response
+from app.data.search import prefix_condition
+from app.data.serialization import object_response
+from app.data.pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, UNPAGINATED_LIMIT, NEXT_CURSOR_HEADER,
+                                 keyset_page, parse_fields, projected_response)
 from app.models.user import UserPublic, User, UserCreate
+from app.models.bulk import BulkResult
+from app.models.event import Event
 from app.models.registration import Registration
 
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+# Key columns of the searches on each field: the name and the email ignore the case, like their indexes
+# (see app/models/user.py). The username is the last key, so every user has its own position (needed by the cursor).
+USER_SEARCH_KEYS = {
+    "username": [User.username],
+    "name": [User.name.collate("NOCASE").label("name_key"), User.username],
+    "email": [User.email.collate("NOCASE").label("email_key"), User.username],
+}
 
 
-@router.get("/")
-def get_users(session: SessionDep) -> list[UserPublic]:
-    """Returns the list of existing users"""
-    users = session.exec(select(User)).all() # Queries all the users in the users table
-    return users
+@router.get("/", response_model=list[UserPublic])
+async def get_users(
+        request: Request,
+        response: Response,
+        session: ReadSessionDep,
+        after: Annotated[str | None, Query(description="Cursor returned in the X-Next-Cursor header")] = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE, description="Maximum number of users")] = DEFAULT_PAGE_SIZE,
+        fields: Annotated[str | None, Query(description="Comma-separated list of the fields to return")] = None,
+        unpaginated: Annotated[bool, Query(alias="all", description=f"Returns up to {UNPAGINATED_LIMIT} users")] = False,
+        prefix: Annotated[str | None, Query(min_length=1, description="Only the users whose field starts with this value")] = None,
+        field: Annotated[Literal["username", "name", "email"], Query(description="Field searched by prefix")] = "username",
+        accept: Annotated[str | None, Header(description="application/x-ndjson or text/csv to export every user")] = None
+):
+    """Returns the list of existing users, one page at a time (sorted by username).
+
+    With prefix, only the users whose username (or name, or email, ignoring the case) starts with it, sorted by that field."""
+    # A query parameter of the list (and not a /users/search route), so no username is shadowed by the search
+    selected_fields = parse_fields(fields, UserPublic)
+    keys = USER_SEARCH_KEYS[field] if prefix is not None else [User.username]
+    columns = [getattr(User, field) for field in selected_fields or UserPublic.model_fields]
+    for key in keys: # The key columns are always needed to build the cursor
+        if key not in columns:
+            columns.append(key)
+    conditions = []
+    if prefix is not None:
+        # A range scan on the index of the field: only the matching users (up to a page) are read
+        conditions.append(prefix_condition(keys[0], prefix, ignore_case=field != "username"))
+
+    export_format = export_media_type(accept)
+    if export_format:
+        # The export streams every matching user, so the pagination parameters are ignored
+        return export_response(export_format, columns, keys, selected_fields or list(UserPublic.model_fields), "users",
+                               conditions)
+
+    # Same as in get_events: the generation is read before the users
+    etag = collection_etag(request, await get_generations(session, User.__tablename__))
+    cached_response = not_modified(request, etag)
+    if cached_response:
+        return cached_response
+
+    if unpaginated:
+        limit = UNPAGINATED_LIMIT
+
+    users, next_cursor = await keyset_page(session, select(*columns).where(*conditions), keys, after, limit)
+
+    if selected_fields or config.fast_json: # Encoded directly, without validating the rows again
+        projected = projected_response(users, selected_fields or list(UserPublic.model_fields), next_cursor)
+        projected.headers.update(conditional_headers(etag))
+        return projected
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    response.headers.update(conditional_headers(etag))
+    return [UserPublic.model_validate(user) for user in users]
 
 
 @router.post("/")
-def create_user(session: SessionDep, new_user: UserCreate):
+async def create_user(session: AsyncSessionDep, new_user: UserCreate):
     """Creates a new user"""
 
-    # Before adding a user, we check if an email is already registered
+    # Before adding a user, we check if an email is already registered (a lookup on the email index)
     statement = select(User).where(User.email == new_user.email)
 
-    duplicated_user_email = session.exec(statement).first()
+    duplicated_user_email = (await session.exec(statement)).first()
     # .first() returns the first value of the query or None if no match is found
 
     if duplicated_user_email:
         raise HTTPException(status_code=409, detail="Email already registered") # 409 Conflict
 
     # Now we check if the username is already taken
-    duplicated_user_username = session.get(User, new_user.username)
+    duplicated_user_username = await session.get(User, new_user.username)
 
     if duplicated_user_username:
         raise HTTPException(status_code=409, detail="Username is already taken") # 409 Conflict
     else:
         session.add(User.model_validate(new_user))
-        session.commit()
+        await bump_generation(session, User.__tablename__)
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Another request used the same username or email after our checks:
+            # the primary key and the unique index on the email rejected this one.
+            raise HTTPException(status_code=409, detail="Username or email already registered")
+        change_bus.publish(User.__tablename__, "created", new_user.username)
 
     return "User successfully created"
 
 
+@router.post("/bulk", openapi_extra=BULK_OPENAPI_EXTRA)
+async def create_users_bulk(session: AsyncSessionDep, rows: BulkBodyDep) -> list[BulkResult]:
+    """Creates many users at once, reporting the outcome of each one."""
+    results: list[BulkResult | None] = [None] * len(rows)
+    valid_users = validate_rows(rows, UserCreate, results)
+    created = False
+
+    for chunk in chunks(valid_users):
+        for _ in range(BULK_INSERT_ATTEMPTS):
+            new_users = await _check_new_users(session, chunk, results)
+            if not new_users:
+                await session.commit()
+                break
+            try:
+                await session.exec(insert(User), params=new_users) # A single executemany for the whole chunk
+                await bump_generation(session, User.__tablename__)
+                await session.commit()
+            except IntegrityError:
+                # Another request created some of these users after the check: the chunk was rolled back,
+                # and the check runs again, finding them (only those rows get a 409)
+                await session.rollback()
+                continue
+            created = True
+            break
+        else:
+            # Still rejected after every attempt: the rows of the chunk that weren't already reported are conflicts
+            for index, _ in chunk:
+                if results[index].status_code == 201:
+                    results[index] = BulkResult(index=index, status_code=409,
+                                                detail="Username or email already registered")
+
+    if created:
+        change_bus.publish(User.__tablename__, "created") # Many users: a single change, without username
+    return results
+
+
+async def _check_new_users(session, chunk: list, results: list) -> list[dict]:
+    """Checks the users of a chunk, setting their results, and returns the ones to insert."""
+    # The duplicates of the whole chunk are found with a single query (instead of two per user)
+    usernames = [user.username for _, user in chunk]
+    emails = [user.email for _, user in chunk]
+    statement = select(User.username, User.email).where(or_(User.username.in_(usernames), # NOQA
+                                                            User.email.in_(emails))) # NOQA
+    existing_users = (await session.exec(statement)).all()
+    taken_usernames = {user.username for user in existing_users}
+    taken_emails = {user.email for user in existing_users}
+
+    new_users = []
+    for index, user in chunk:
+        # The checks are the same of create_user, in the same order
+        if user.email in taken_emails:
+            results[index] = BulkResult(index=index, status_code=409, detail="Email already registered")
+        elif user.username in taken_usernames:
+            results[index] = BulkResult(index=index, status_code=409, detail="Username is already taken")
+        else:
+            # Adding the new values to the sets also rejects the duplicates inside the request itself
+            taken_usernames.add(user.username)
+            taken_emails.add(user.email)
+            new_users.append(user.model_dump())
+            results[index] = BulkResult(index=index, status_code=201, detail="User successfully created")
+    return new_users
+
+
 @router.delete("/")
-def delete_users(session: SessionDep):
+async def delete_users(session: AsyncSessionDep):
     """Deletes all users from the list."""
-    session.exec(delete(User))
-    session.commit()
-
-    # Deletes all registrations from the list (same reason as in events endpoint).
-    session.exec(delete(Registration))
-    session.commit()
+    await session.exec(delete(User))
+    # The registrations are deleted by the database too (same as in events endpoint),
+    # so every event is left without registrations.
+    await session.exec(update(Event).where(Event.registered_count != 0).values(registered_count=0)) # NOQA
+    await bump_generation(session, User.__tablename__, Registration.__tablename__, Event.__tablename__)
+    await session.commit()
+    user_cache.clear()
+    clear_events()
+    change_bus.publish(User.__tablename__, "deleted") # With every registration
 
     # We don't check if users table is empty (same reason as in events endpoint).
     return "Users successfully deleted"
 
 
 @router.get("/{username}", response_model=UserPublic)
-def get_user_by_username(
+async def get_user_by_username(
         username: Annotated[str, Path(description="Username of the user to search")],
-        session: SessionDep
+        request: Request,
+        response: Response,
+        session: AsyncSessionDep
 ):
     """Retrieves a user by username from the database."""
-    user = session.get(User, username) # User is the table, username is the PK.
+    user = await get_user(session, username) # User is the table, username is the PK (read through the cache).
     if user: # If the user is found, we return it; otherwise we return error code 404.
+        etag = resource_etag(username, user.updated_at)
+        cached_response = not_modified(request, etag, user.updated_at)
+        if cached_response:
+            return cached_response
+        if config.fast_json:
+            return object_response(user, UserPublic.model_fields, conditional_headers(etag, user.updated_at))
+        response.headers.update(conditional_headers(etag, user.updated_at))
         return user
     else:
         raise HTTPException(status_code=404, detail="User not found")
 
 
 @router.delete("/{username}")
-def delete_a_user(
+async def delete_a_user(
         username: Annotated[str, Path(description="Username of the user to delete")],
-        session: SessionDep
+        session: AsyncSessionDep
 ):
     """Deletes a user from the list."""
 
-    # We check if the user exists
-    existing_user = session.get(User, username)
-
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    else:
-        user_to_delete = session.get(User, username)
-        session.delete(user_to_delete)
-        session.commit()
+    # The seats of the user's registrations are released before the registrations are deleted
+    statement = update(Event).where(
+        Event.id.in_(select(Registration.event_id).where(Registration.username == username)) # NOQA
+    ).values(registered_count=Event.registered_count - 1).returning(Event.id)
+    released_event_ids = (await session.exec(statement)).scalars().all()
 
+    # We check if the user exists through the number of deleted rows: the user and its registrations
+    # (ON DELETE CASCADE) are deleted by a single statement.
+    statement = delete(User).where(User.username == username)  # NOQA
+    # With NOQA, we are disabling warnings that are known bugs in type checks with SQLAlchemy (safe to ignore)
+    result = await session.exec(statement)
 
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    statement = delete(Registration).where(Registration.username == username)  # NOQA
-    # With NOQA, we are disabling warnings that are known bugs in type checks with SQLAlchemy (safe to ignore)
-    session.exec(statement)
-    session.commit()
+    await bump_generation(session, User.__tablename__, Registration.__tablename__, Event.__tablename__)
+    await session.commit()
+    user_cache.invalidate(username)
+    for event_id in released_event_ids:
+        invalidate_event(event_id)
+    change_bus.publish(User.__tablename__, "deleted", username) # With the registrations of the user
 
     return "User successfully deleted."
 
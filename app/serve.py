@@ -0,0 +1,32 @@
+import argparse
+import os
+
+
+# -- Notes:
+# A single process serves the requests with a single core. This launcher starts many worker processes on
+# the same SQLite database: with the WAL journal, the readers of every process run in parallel (only the
+# writes take turns). The database is created, migrated and seeded here, once, before the workers start;
+# each worker keeps its own caches, which are kept coherent by app/data/coordination.py.
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs the application with many worker processes.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: one per core)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    # Read by the configuration of this process and of the workers (which inherit the environment)
+    os.environ.setdefault("APP_ENV", "production")
+
+    import uvicorn # Installed with fastapi[standard]
+    from app.data.db import init_database
+
+    init_database()
+    os.environ["APP_DB_INIT"] = "0" # Already done: the workers skip it
+
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers,
+                log_level="warning" if os.environ["APP_ENV"] == "production" else "info")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+// Live changes of events, users and registrations, sent by the server (see GET /changes).
+// Every change is {seq, type, action, id}: "type" is "event", "user" or "registration", "action" is
+// "created", "updated" or "deleted", and a null "id" stands for many rows (which must be loaded again).
+// The browser reconnects by itself, resuming from the last change received; when the missed changes
+// can't be resumed, the action is "reset" and every row must be loaded again.
+function subscribeChanges(onChange) {
+  if (!window.EventSource) {
+    return null;
+  }
+  const source = new EventSource('/changes/');
+  source.addEventListener('message', function(message) {
+    onChange(JSON.parse(message.data));
+  });
+  return source;
+}
+
+// True when the changes are being received: otherwise a page must load its data again by itself
+function changesConnected(source) {
+  return source !== null && source.readyState === EventSource.OPEN;
+}
@@ -0,0 +1,63 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+# For each metric: True if a higher value is better
+METRICS = {
+    "throughput": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Prints the difference of every metric and returns the regressions bigger than threshold (e.g. 0.1 = 10%)."""
+    regressions = []
+    print(f"{'scenario':26} {'metric':>10} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, current_result in current["scenarios"].items():
+        baseline_result = baseline["scenarios"].get(name)
+        if baseline_result is None:
+            print(f"{name:26} (not in the baseline)")
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = baseline_result[metric], current_result[metric]
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.1%})")
+            print(f"{name:26} {metric:>10} {old:>12.2f} {new:>12.2f} {change:>+9.1%}{flag}")
+        if current_result["errors"] > baseline_result["errors"]:
+            regressions.append(f"{name} errors: {baseline_result['errors']} -> {current_result['errors']}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compares two benchmark results, flagging the regressions.")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change considered a regression (default: %(default)s, i.e. 10%%)")
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())
+    current = json.loads(args.current.read_text())
+    if baseline["meta"]["requests"] != current["meta"]["requests"] or \
+            baseline["meta"]["users"] != current["meta"]["users"]:
+        print("Warning: the two runs used different parameters, the results may not be comparable")
+
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1) # Lets a CI job fail on a regression
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+# -- Notes:
+# The benchmark runs the application in-process (through the httpx ASGI transport), so it measures the
+# routers and the data layer without the noise of a real network. The clients are asyncio tasks sharing
+# the same event loop of the application, like the requests served by a single uvicorn worker.
+#
+# The settings in app/config.py are read when the app modules are imported, so every app import is done
+# inside main(), after the environment variables have been set.
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Returns the given percentile of an already sorted list (nearest-rank method)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0, # Requests per second
+        # Latencies in milliseconds
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+async def run_scenario(client, make_request, requests: int, concurrency: int) -> dict:
+    """Sends requests with the given number of concurrent clients and measures each one.
+
+    make_request(client, i) sends the i-th request and returns True if the response was the expected one."""
+    latencies: list[float] = []
+    errors = 0
+    next_request = 0
+
+    async def worker():
+        nonlocal next_request, errors
+        while next_request < requests:
+            i = next_request
+            next_request += 1 # No lock needed: the tasks only switch at the awaits
+            start = time.perf_counter()
+            ok = await make_request(client, i)
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def build_scenarios(args, rng: random.Random, usernames: list[str], users_by_name: dict) -> dict:
+    """Returns the scenarios in the order they are run: the writes use the rows created by the previous ones."""
+    run_id = int(time.time()) # Makes the created rows unique across runs on the same database
+    created_users: list[dict] = []
+    created_events: list[int] = []
+    # The write scenarios work on the rows created by the previous ones, so the deletes also remove
+    # the registrations made by the register scenario (and the seeded data stays the same).
+
+    async def list_events(client, i):
+        return (await client.get("/events/", params={"limit": 100})).status_code == 200
+
+    async def list_users(client, i):
+        return (await client.get("/users/", params={"limit": 100})).status_code == 200
+
+    async def list_registrations(client, i):
+        return (await client.get("/registrations/", params={"limit": 100})).status_code == 200
+
+    async def list_event_registrations(client, i):
+        event_id = rng.randint(1, args.events)
+        return (await client.get(f"/events/{event_id}/registrations", params={"limit": 100})).status_code == 200
+
+    async def get_event(client, i):
+        return (await client.get(f"/events/{rng.randint(1, args.events)}")).status_code == 200
+
+    async def get_user(client, i):
+        return (await client.get(f"/users/{rng.choice(usernames)}")).status_code == 200
+
+    async def create_user(client, i):
+        user = {"username": f"bench-{run_id}-{i}", "name": "Benchmark User", "email": f"bench-{run_id}-{i}@example.com"}
+        response = await client.post("/users/", json=user)
+        if response.status_code == 200:
+            created_users.append(user)
+        return response.status_code == 200
+
+    async def create_event(client, i):
+        event = {
+            "title": f"Benchmark event {run_id}-{i}",
+            "description": "Created by the benchmark",
+            "date": "2030-01-01T10:00:00",
+            "location": "Benchmark",
+        }
+        response = await client.post("/events/", json=event)
+        if response.status_code == 200:
+            # The route doesn't return the ID: the new events get the IDs after the last existing one
+            created_events.append(args.events + len(created_events) + 1)
+        return response.status_code == 200
+
+    async def register(client, i):
+        # Every request uses a different (user, event) combination
+        users = created_users or [users_by_name[username] for username in usernames]
+        event_ids = created_events or range(1, args.events + 1)
+        event_id = event_ids[i % len(event_ids)] # Spread over the events, so every delete has registrations to remove
+        user = users[(i // len(event_ids)) % len(users)]
+        response = await client.post(f"/events/{event_id}/register", json=user)
+        return response.status_code in (200, 409) # 409: registration left by a previous run
+
+    async def delete_event_cascade(client, i):
+        # Deletes the events created by create_event, together with their registrations
+        if i >= len(created_events):
+            return False
+        return (await client.delete(f"/events/{created_events[i]}")).status_code == 200
+
+    async def delete_user_cascade(client, i):
+        if i >= len(created_users):
+            return False
+        return (await client.delete(f"/users/{created_users[i]['username']}")).status_code == 200
+
+    async def mixed(client, i):
+        # Mostly reads, with a write every few requests: shows the contention between readers and the writer
+        if rng.random() < args.write_ratio:
+            event = {
+                "title": f"Mixed event {run_id}-{i}",
+                "description": "Created by the benchmark",
+                "date": "2030-01-01T10:00:00",
+                "location": "Benchmark",
+            }
+            return (await client.post("/events/", json=event)).status_code == 200
+        if rng.random() < 0.5:
+            return await get_event(client, i)
+        return await list_events(client, i)
+
+    return {
+        "list_events": list_events,
+        "list_users": list_users,
+        "list_registrations": list_registrations,
+        "list_event_registrations": list_event_registrations,
+        "get_event": get_event,
+        "get_user": get_user,
+        "create_user": create_user,
+        "create_event": create_event,
+        "register": register,
+        "delete_event_cascade": delete_event_cascade,
+        "delete_user_cascade": delete_user_cascade,
+        "mixed": mixed,
+    }
+
+
+async def run_benchmark(args) -> dict:
+    import httpx
+    from app.config import config
+    from app.main import app
+
+    results = {}
+    rng = random.Random(args.seed)
+
+    # ASGITransport doesn't send the lifespan events, so the database is initialized here
+    async with app.router.lifespan_context(app):
+        # The exceptions of the app become 500 responses (counted as errors) instead of stopping the benchmark
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            users = (await client.get("/users/", params={"limit": 1000})).json()
+            usernames = [user["username"] for user in users]
+            users_by_name = {user["username"]: user for user in users}
+
+            scenarios = build_scenarios(args, rng, usernames, users_by_name)
+            for name, make_request in scenarios.items():
+                if args.only and name not in args.only:
+                    continue
+                concurrency = args.concurrency if name == "mixed" or args.concurrent_all else 1
+                results[name] = await run_scenario(client, make_request, args.requests, concurrency)
+                results[name]["concurrency"] = concurrency
+                print(f"{name:26} {results[name]['throughput']:>10.1f} req/s  "
+                      f"p50 {results[name]['p50_ms']:>8.2f} ms  p95 {results[name]['p95_ms']:>8.2f} ms  "
+                      f"p99 {results[name]['p99_ms']:>8.2f} ms  errors {results[name]['errors']}")
+
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "users": args.users,
+            "events": args.events,
+            "registrations": args.registrations,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "async_database": config.async_database,
+            "pool_class": config.pool_class,
+            "cache_enabled": config.cache_enabled,
+        },
+        "scenarios": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measures the throughput and latency of every router.")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--events", type=int, default=1_000)
+    parser.add_argument("--registrations", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the data generator and of the requests")
+    parser.add_argument("--requests", type=int, default=500, help="Requests sent by each scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients of the mixed scenario")
+    parser.add_argument("--concurrent-all", action="store_true",
+                        help="Uses --concurrency clients for every scenario (not only the mixed one)")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="Share of writes in the mixed scenario")
+    parser.add_argument("--only", nargs="*", help="Runs only the given scenarios")
+    parser.add_argument("--db", type=Path, default=None,
+                        help="Existing database to use (default: a new temporary one, seeded with the sizes above)")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Where to save the results (default: benchmarks/results/<date>.json)")
+    args = parser.parse_args()
+
+    # The SQL log would dominate the measures, so it's disabled unless explicitly requested
+    os.environ.setdefault("APP_SQL_ECHO", "0")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database_file = args.db or Path(temp_dir) / "benchmark.db"
+        os.environ["APP_DATABASE_FILE"] = str(database_file)
+
+        if args.db is None:
+            from sqlmodel import SQLModel
+            from app.data.engine import create_db_engine
+            from app.data.seed import seed_database
+
+            start = time.perf_counter()
+            engine = create_db_engine(f"sqlite:///{database_file}", echo=False)
+            SQLModel.metadata.create_all(engine)
+            seed_database(engine, args.users, args.events, args.registrations, args.seed)
+            engine.dispose()
+            print(f"Seeded {args.users} users, {args.events} events and {args.registrations} registrations "
+                  f"in {time.perf_counter() - start:.1f}s")
+        else:
+            # With an existing database, the sizes are only used to choose the events to request
+            import sqlite3
+            with sqlite3.connect(database_file) as connection:
+                args.events = connection.execute("SELECT MAX(id) FROM event").fetchone()[0] or 1
+
+        results = asyncio.run(run_benchmark(args))
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
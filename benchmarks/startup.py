@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.run import RESULTS_DIR
+
+
+# -- Notes:
+# Every start runs in a new interpreter, as a new worker (or a new instance, with autoscaling) would, so
+# nothing is already imported or cached. The probe below measures, inside that process, the import of the
+# application, the lifespan start (the initialization of the database) and the first request; the whole
+# process (with the start of the interpreter) is measured from outside.
+# The "cold" starts create and seed a new database, the "warm" ones find it already up to date.
+
+_PROBE = """
+import json, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+import asyncio, httpx
+
+async def first_request():
+    # ASGITransport doesn't send the lifespan events, so the application is started here
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            response = await client.get("/events/")
+        assert response.status_code == 200, response.status_code
+        return started, time.perf_counter()
+
+started, responded = asyncio.run(first_request())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "lifespan_ms": (started - imported) * 1000,
+    "first_request_ms": (responded - started) * 1000,
+    "ready_ms": (responded - start) * 1000,
+}))
+"""
+
+MEASURES = ("process_ms", "import_ms", "lifespan_ms", "first_request_ms", "ready_ms")
+
+
+def measure_start(database_file: Path) -> dict:
+    """Starts the application in a new process on the given database and returns its timings, in milliseconds."""
+    environment = dict(os.environ, APP_DATABASE_FILE=str(database_file))
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", _PROBE], env=environment, check=True,
+                            capture_output=True, text=True).stdout
+    process_ms = (time.perf_counter() - start) * 1000
+    return {"process_ms": process_ms, **json.loads(output.splitlines()[-1])}
+
+
+def summarize(timings: list[dict]) -> dict:
+    return {
+        measure: {
+            "median_ms": round(statistics.median(timing[measure] for timing in timings), 2),
+            "min_ms": round(min(timing[measure] for timing in timings), 2),
+        }
+        for measure in MEASURES
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measures the start of the application: import time, "
+                                                 "initialization of the database and first request.")
+    parser.add_argument("--runs", type=int, default=5, help="Starts measured for each case")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Where to save the results (default: benchmarks/results/startup-<date>.json)")
+    args = parser.parse_args()
+
+    # The SQL log would dominate the measures, so it's disabled unless explicitly requested
+    os.environ.setdefault("APP_SQL_ECHO", "0")
+
+    cases = {"cold": [], "warm": []}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for run in range(args.runs):
+            database_file = Path(temp_dir) / f"startup-{run}.db"
+            cases["cold"].append(measure_start(database_file)) # Creates the database...
+            cases["warm"].append(measure_start(database_file)) # ...that the next start finds
+
+    results = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "runs": args.runs,
+        },
+        "cases": {name: summarize(timings) for name, timings in cases.items()},
+    }
+    for name, summary in results["cases"].items():
+        print(f"{name:6} " + "  ".join(f"{measure} {summary[measure]['median_ms']:>8.1f}" for measure in MEASURES))
+
+    output = args.output or RESULTS_DIR / f"startup-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
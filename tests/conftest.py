@@ -0,0 +1,55 @@
+import itertools
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from app.config import config
+
+
+# The tests run the application on a temporary database: config.root_dir (read when the app modules are
+# imported) points to a temporary directory, where the static files and the templates link to the real ones.
+_root_dir = tempfile.TemporaryDirectory()
+for _name in ("static", "templates"):
+    (Path(_root_dir.name) / _name).symlink_to(Path(__file__).parent.parent / "app" / _name)
+(Path(_root_dir.name) / "data").mkdir()
+config.root_dir = _root_dir.name
+os.environ.setdefault("APP_SQL_ECHO", "0")
+
+_unique_numbers = itertools.count() # Tell apart the rows created by the tests, which share the database
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client: # Runs the lifespan: the database is created and seeded
+        yield client
+
+
+@pytest.fixture
+def new_user(client):
+    """Creates a user with a unique username and returns it."""
+    def create() -> dict:
+        number = next(_unique_numbers)
+        user = {"username": f"test-{number}", "name": "Test", "email": f"test-{number}@test.it"}
+        response = client.post("/users", json=user)
+        assert response.is_success, response.text
+        return user
+    return create
+
+
+@pytest.fixture
+def new_event(client):
+    """Creates an event with a unique title and returns its ID."""
+    def create(**fields) -> int:
+        title = f"Test {next(_unique_numbers)}"
+        event = {"title": title, "description": "Test", "location": "Test",
+                 "date": "2031-01-01T10:00:00", **fields}
+        response = client.post("/events", json=event)
+        assert response.is_success, response.text
+        events = client.get("/events", params={"all": "true", "fields": "id,title"}).json() # The ID isn't returned
+        return next(event["id"] for event in events if event["title"] == title)
+    return create
@@ -0,0 +1,57 @@
+from app.data.changes import ChangeBus, change_bus
+
+
+def _queued(subscription) -> list[dict]:
+    changes = []
+    while not subscription.queue.empty():
+        changes.append(subscription.queue.get_nowait())
+    return changes
+
+
+def test_publish_to_every_subscriber():
+    bus = ChangeBus(history_size=10, buffer_size=10)
+    first, second = bus.subscribe(), bus.subscribe()
+    change = bus.publish("event", "created", 1)
+    assert change == {"seq": bus.sequence, "type": "event", "action": "created", "id": 1}
+    assert _queued(first) == _queued(second) == [change]
+
+    bus.unsubscribe(second)
+    bus.publish("event", "deleted", 1)
+    assert len(_queued(first)) == 1 and _queued(second) == []
+
+
+def test_resume_after_a_change():
+    bus = ChangeBus(history_size=10, buffer_size=10)
+    changes = [bus.publish("user", "created", f"user-{number}") for number in range(3)]
+    assert _queued(bus.subscribe(after=changes[0]["seq"])) == changes[1:]
+    assert _queued(bus.subscribe(after=changes[-1]["seq"])) == [] # Nothing missed
+
+
+def test_reset_when_the_changes_are_gone():
+    bus = ChangeBus(history_size=2, buffer_size=10)
+    changes = [bus.publish("user", "created", f"user-{number}") for number in range(4)]
+    for after in (changes[0]["seq"], # Out of the history
+                  bus.sequence + 10): # Of another run
+        assert [change["action"] for change in _queued(bus.subscribe(after=after))] == ["reset"]
+    assert bus.resets == 2
+
+
+def test_slow_subscriber_is_dropped():
+    bus = ChangeBus(history_size=10, buffer_size=2)
+    subscription = bus.subscribe()
+    changes = [bus.publish("event", "updated", number) for number in range(3)]
+    assert subscription.dropped and bus.dropped == 1
+    assert _queued(subscription) == changes[:2] # The queued changes are still sent
+    # The subscriber resumes from its last change
+    assert _queued(bus.subscribe(after=changes[1]["seq"])) == changes[2:]
+
+
+def test_writes_publish_their_changes(client, new_user):
+    subscription = change_bus.subscribe()
+    try:
+        user = new_user()
+        assert client.delete(f"/users/{user['username']}").status_code == 200
+    finally:
+        change_bus.unsubscribe(subscription)
+    assert [(change["type"], change["action"], change["id"]) for change in _queued(subscription)] == [
+        ("user", "created", user["username"]), ("user", "deleted", user["username"])]
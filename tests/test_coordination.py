@@ -0,0 +1,53 @@
+import multiprocessing
+
+import pytest
+
+from app.data.coordination import TableVersions, TABLES
+
+
+@pytest.fixture
+def versions_file(tmp_path, monkeypatch):
+    path = tmp_path / "test.db-versions"
+    monkeypatch.setattr(TableVersions, "path", property(lambda self: path))
+    return path
+
+
+def _commit_generations(worker: int, workers: int, commits: int) -> None:
+    versions = TableVersions() # A forked process: the path of the fixture is inherited
+    for commit in range(commits): # Every worker gets different generations, interleaved with the others
+        versions.committed({table: commit * workers + worker + 1 for table in TABLES})
+
+
+def test_counters_never_go_back(versions_file):
+    # Many workers committing at the same time
+    workers, commits = 4, 2000
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_commit_generations, args=(worker, workers, commits))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    versions = TableVersions()
+    versions._open()
+    assert versions._seen == [workers * commits] * len(TABLES) # The highest generation of every table
+
+
+def test_own_commits_keep_the_local_state(versions_file):
+    worker, other = TableVersions(), TableVersions()
+    changes = []
+    worker.on_change("event", lambda: changes.append("event"))
+    worker.sync()
+
+    worker.committed({"event": 1})
+    worker.sync()
+    assert changes == [] # Already invalidated by the route
+
+    other.committed({"event": 3})
+    worker.committed({"event": 2}) # Stored after a newer generation: ignored
+    worker.sync()
+    assert changes == ["event"] # The change of the other worker
+    worker.sync()
+    assert changes == ["event"]
@@ -0,0 +1,233 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, text
+
+from app.data.db import engine
+from app.data.pagination import encode_cursor
+from app.models.event import Event, EventCreate, event_fingerprint
+from app.routers import events
+
+
+def _all_pages(client, path: str, **params) -> list[dict]:
+    # Follows the X-Next-Cursor header until the last page
+    rows = []
+    while True:
+        response = client.get(path, params=params)
+        assert response.status_code == 200, response.text
+        rows += response.json()
+        if "x-next-cursor" not in response.headers:
+            return rows
+        params["after"] = response.headers["x-next-cursor"]
+
+
+def test_pages_cover_every_event_once(client, new_event):
+    for _ in range(3):
+        new_event()
+    every_event = client.get("/events", params={"all": "true"}).json()
+
+    paged = _all_pages(client, "/events", limit=2)
+    assert [event["id"] for event in paged] == sorted(event["id"] for event in every_event)
+
+
+def test_last_page_has_no_cursor(client, new_event):
+    event_id = new_event()
+    response = client.get("/events", params={"limit": 1000})
+    assert response.json()[-1]["id"] == event_id
+    assert "x-next-cursor" not in response.headers
+
+
+def test_fields_projection(client, new_event):
+    event_id = new_event()
+    events = client.get("/events", params={"all": "true", "fields": "title,id"}).json()
+    # The fields keep the order of the model
+    assert list(next(event for event in events if event["id"] == event_id)) == ["title", "id"]
+
+
+def test_pages_of_the_key_alone(client, new_event):
+    # A single column is selected: the rows are bare values, the cursor is still built from them
+    for _ in range(3):
+        new_event()
+    every_event = client.get("/events", params={"all": "true", "fields": "id"}).json()
+    assert _all_pages(client, "/events", limit=2, fields="id") == every_event
+    response = client.get("/events", params={"fields": "id"}, headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line) for line in response.text.splitlines()] == every_event
+
+
+def test_unknown_fields(client):
+    response = client.get("/events", params={"fields": "title,password"})
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+
+
+def test_invalid_cursor(client):
+    assert client.get("/events", params={"after": "not a cursor"}).status_code == 400
+
+
+@pytest.mark.parametrize("params", [
+    {"after": encode_cursor(value)} for value in (None, [], {}, True, "1", 1.5, 2 ** 63)
+] + [
+    {"sort": "date", "after": encode_cursor(value, 1)} for value in (None, 1, "not a date")
+] + [
+    {"sort": "title", "after": encode_cursor(1, 1)},
+    {"sort": "title", "after": encode_cursor("Title", "1")},
+])
+def test_cursor_values_of_the_wrong_type(client, params):
+    response = client.get("/events", params=params)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid pagination cursor"
+
+
+def test_limit_bounds(client):
+    assert client.get("/events", params={"limit": 0}).status_code == 422
+    assert client.get("/events", params={"limit": 1001}).status_code == 422
+
+
+def test_bulk_create_rejects_duplicates(client, new_event):
+    existing = client.get(f"/events/{new_event()}").json()
+    event = {field: existing[field] for field in ("title", "description", "location", "date")}
+    new = dict(event, title=f"{event['title']} bulk")
+    response = client.post("/events/bulk", json=[new, event, new, {"title": "Missing fields"}])
+    assert response.status_code == 200, response.text
+    assert [result["status_code"] for result in response.json()] == [201, 409, 409, 422]
+    titles = [event["title"] for event in client.get("/events", params={"all": "true", "fields": "title"}).json()]
+    assert titles.count(new["title"]) == 1
+
+
+def test_duplicate_event(client, new_event):
+    existing = client.get(f"/events/{new_event()}").json()
+    event = {field: existing[field] for field in ("title", "description", "location", "date")}
+    response = client.post("/events", json=event)
+    assert response.status_code == 409
+    assert response.json()["detail"] == "The event already exists."
+    assert client.post("/events", json=dict(event, location="Elsewhere")).is_success
+
+
+def test_fingerprint_is_unique(client, new_event):
+    # A duplicate that got past the check (e.g. a concurrent request) is rejected by the unique index
+    existing = Event.model_validate(client.get(f"/events/{new_event()}").json())
+    duplicate = Event(title=existing.title, description=existing.description, location=existing.location,
+                      date=existing.date, fingerprint=event_fingerprint(existing))
+    with Session(engine) as session:
+        session.add(duplicate)
+        with pytest.raises(IntegrityError):
+            session.commit()
+
+
+@pytest.fixture
+def dated_events(new_event):
+    """Creates three events in a new location, on different dates; returns the location and their IDs."""
+    location = f"Place{uuid.uuid4().hex}" # A single word, to search it too
+    dates = ("2031-03-01T10:00:00", "2031-01-01T10:00:00", "2031-02-01T10:00:00")
+    return location, [new_event(location=location, date=date) for date in dates]
+
+
+def _ids(client, **params) -> list[int]:
+    return [event["id"] for event in _all_pages(client, "/events", limit=2, **params)]
+
+
+def test_location_filter(client, dated_events):
+    location, ids = dated_events
+    assert _ids(client, location=location) == ids
+    assert _ids(client, location=location.upper()) == [] # An exact match
+
+
+def test_date_range(client, dated_events):
+    location, ids = dated_events
+    assert _ids(client, location=location, **{"from": "2031-02-01T00:00:00"}) == [ids[0], ids[2]]
+    assert _ids(client, location=location, to="2031-02-01T10:00:00") == [ids[1], ids[2]] # Inclusive
+    assert _ids(client, location=location, **{"from": "2031-01-15T00:00:00", "to": "2031-02-15T00:00:00"}) == [ids[2]]
+
+
+def test_search(client, dated_events, new_event):
+    location, ids = dated_events
+    assert _ids(client, q=location) == ids
+    assert _ids(client, q=location, **{"from": "2031-02-01T00:00:00"}) == [ids[0], ids[2]]
+    assert _ids(client, q=f"nothing{location}") == []
+
+
+def test_sort_orders(client, dated_events):
+    location, ids = dated_events
+    # The order is kept across the pages (two events each)
+    assert _ids(client, location=location, sort="date") == [ids[1], ids[2], ids[0]]
+    assert _ids(client, location=location, sort="-date") == [ids[0], ids[2], ids[1]]
+    events = _all_pages(client, "/events", limit=2, sort="title", fields="id,title")
+    keys = [(event["title"], event["id"]) for event in events]
+    assert keys == sorted(keys) and len(keys) == len(client.get("/events", params={"all": "true"}).json())
+
+
+def test_invalid_sort(client):
+    assert client.get("/events", params={"sort": "location"}).status_code == 422
+
+
+def _query_plan(sql: str, **params) -> str:
+    with engine.connect() as connection:
+        return " ".join(row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params))
+
+
+def test_date_range_uses_the_index(client):
+    plan = _query_plan("SELECT id FROM event WHERE date >= :start ORDER BY date, id", start="2031-01-01")
+    assert "USING INDEX ix_event_date" in plan or "USING COVERING INDEX ix_event_date" in plan
+    assert "TEMP B-TREE" not in plan # Read in the order of the index, without sorting
+
+
+def test_update_capacity_only(client, new_event):
+    event_id = new_event(capacity=3)
+    event = client.get(f"/events/{event_id}").json()
+    fields = {field: event[field] for field in ("title", "description", "location", "date")}
+
+    response = client.put(f"/events/{event_id}", json={**fields, "capacity": 5})
+    assert response.status_code == 200, response.text
+    assert client.get(f"/events/{event_id}").json()["capacity"] == 5
+
+
+def test_update_into_duplicate(client, new_event):
+    first_id, second_id = new_event(), new_event()
+    first = client.get(f"/events/{first_id}").json()
+    fields = {field: first[field] for field in ("title", "description", "location", "date")}
+
+    response = client.put(f"/events/{second_id}", json=fields)
+    assert response.status_code == 409
+
+
+def test_location_filter_uses_the_index(client):
+    plan = _query_plan("SELECT id FROM event WHERE location = :location AND date >= :start ORDER BY date, id",
+                       location="Test", start="2031-01-01")
+    assert "ix_event_location_date (location=? AND date>?)" in plan
+
+
+def test_export_applies_the_list_filters(client, new_event):
+    location = f"Export {uuid.uuid4().hex}" # Unique for this test
+    ids = [new_event(location=location, date=f"2032-0{month}-01T10:00:00") for month in (1, 2, 3)]
+    params = {"location": location, "from": "2032-02-01T00:00:00"}
+
+    listed = [event["id"] for event in client.get("/events", params=params).json()]
+    response = client.get("/events", params=params, headers={"Accept": "application/x-ndjson"})
+    exported = [json.loads(line)["id"] for line in response.text.splitlines()]
+    assert listed == exported == ids[1:]
+
+
+def test_bulk_create_with_an_event_created_meanwhile(client, monkeypatch):
+    location = f"Bulk {uuid.uuid4().hex}"
+    rows = [{"title": f"Bulk {number}", "description": "Bulk", "location": location, "date": "2031-01-01T10:00:00"}
+            for number in range(3)]
+    check_new_events = events._check_new_events
+
+    async def check_then_create_a_duplicate(session, chunk, fingerprints, results):
+        # Another request creates the second event after the check
+        monkeypatch.setattr(events, "_check_new_events", check_new_events)
+        new_events = await check_new_events(session, chunk, fingerprints, results)
+        event = EventCreate.model_validate(rows[1])
+        with Session(engine) as other_session:
+            other_session.add(Event.model_validate(event, update={"fingerprint": event_fingerprint(event)}))
+            other_session.commit()
+        return new_events
+
+    monkeypatch.setattr(events, "_check_new_events", check_then_create_a_duplicate)
+    response = client.post("/events/bulk", json=rows)
+    assert response.status_code == 200, response.text
+    assert [result["status_code"] for result in response.json()] == [201, 409, 201]
+    created = client.get("/events", params={"all": "true", "location": location, "fields": "title"}).json()
+    assert sorted(event["title"] for event in created) == ["Bulk 0", "Bulk 1", "Bulk 2"]
@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.responses import StreamingResponse
+
+from app.config import config
+from app.instrumentation import InstrumentationMiddleware, RouteMetrics, route_metrics
+
+
+def test_streamed_response_latency_is_the_time_to_first_byte():
+    async def slow_stream():
+        yield "first\n"
+        await asyncio.sleep(0.3) # E.g. a client reading slowly, or a /changes stream waiting for changes
+        yield "second\n"
+
+    async def send(message):
+        pass
+
+    async def receive():
+        await asyncio.Event().wait() # The client stays connected until the end of the stream
+
+    scope = {"type": "http", "method": "GET", "path": "/stream", "headers": [], "query_string": b"",
+             "route": SimpleNamespace(path="/stream")} # Set by the router, after a route matched
+    middleware = InstrumentationMiddleware(StreamingResponse(slow_stream()))
+    asyncio.run(middleware(scope, receive, send))
+
+    metrics = route_metrics[("GET", "/stream")]
+    assert metrics.requests == 1
+    assert metrics.latency_sum < 0.1
+
+
+def test_rows_are_counted_only_on_request(client, monkeypatch):
+    metrics = route_metrics.setdefault(("GET", "/events/"), RouteMetrics())
+    rows = metrics.rows
+    client.get("/events/")
+    assert metrics.rows == rows # Off by default: the results aren't buffered to count them
+    assert "app_sql_rows_total" not in client.get("/metrics").text
+
+    monkeypatch.setattr(config, "metrics_rows", True)
+    count = len(client.get("/events/").json())
+    assert metrics.rows >= rows + count # The events, and the other queries of the route
+    assert "app_sql_rows_total" in client.get("/metrics").text
+
+
+def test_profiling_is_off_by_default(client, monkeypatch):
+    assert not config.profiling_enabled
+    assert client.get("/events/", params={"profile": "1"}).headers["content-type"] == "application/json"
+
+    monkeypatch.setattr(config, "profiling_enabled", True)
+    response = client.get("/events/", params={"profile": "1"})
+    assert response.headers["x-profiled-status"] == "200"
+    assert "rows returned" in response.text
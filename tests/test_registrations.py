@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, update
+
+from app.config import config
+from app.data.batching import registration_batcher
+from app.data.db import engine
+from app.data.pagination import encode_cursor
+from app.models.event import Event
+from app.models.registration import Registration
+from app.routers import events
+
+
+def test_pages_sorted_by_username_and_event(client, new_user, new_event):
+    user = new_user()
+    event_ids = [new_event() for _ in range(3)]
+    for event_id in event_ids:
+        assert client.post(f"/events/{event_id}/register", json=user).is_success
+
+    keys, params = [], {"limit": 2}
+    while True:
+        response = client.get("/registrations", params=params)
+        keys += [(registration["username"], registration["event_id"]) for registration in response.json()]
+        if "x-next-cursor" not in response.headers:
+            break
+        params["after"] = response.headers["x-next-cursor"]
+
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)
+    assert [(user["username"], event_id) for event_id in event_ids] == [key for key in keys if key[0] == user["username"]]
+
+
+def test_bulk_registration_reports_every_row(client, new_user, new_event):
+    event_id = new_event()
+    registered, new = new_user(), new_user()
+    assert client.post(f"/events/{event_id}/register", json=registered).is_success
+    rows = [new, registered, dict(new, name="Other"), {"username": "nobody", "name": "N", "email": "n@test.it"}, new]
+    response = client.post(f"/events/{event_id}/register/bulk", json=rows)
+    assert response.status_code == 200, response.text
+    assert [result["status_code"] for result in response.json()] == [201, 409, 409, 404, 409]
+
+    registrations = client.get("/registrations", params={"all": "true"}).json()
+    assert {"username": new["username"], "event_id": event_id} in registrations
+
+
+def test_bulk_registration_to_missing_event(client, new_user):
+    assert client.post("/events/999999/register/bulk", json=[new_user()]).status_code == 404
+
+
+def _registrations_of(client, key: str, value) -> list:
+    return [registration for registration in client.get("/registrations", params={"all": "true"}).json()
+            if registration[key] == value]
+
+
+def test_deleting_a_user_deletes_its_registrations(client, new_user, new_event):
+    user = new_user()
+    for event_id in (new_event(), new_event()):
+        assert client.post(f"/events/{event_id}/register", json=user).is_success
+
+    assert client.delete(f"/users/{user['username']}").status_code == 200
+    assert _registrations_of(client, "username", user["username"]) == []
+    assert client.delete(f"/users/{user['username']}").status_code == 404
+
+
+def test_deleting_an_event_deletes_its_registrations(client, new_user, new_event):
+    event_id = new_event()
+    for user in (new_user(), new_user()):
+        assert client.post(f"/events/{event_id}/register", json=user).is_success
+
+    assert client.delete(f"/events/{event_id}").status_code == 200
+    assert _registrations_of(client, "event_id", event_id) == []
+    assert client.delete(f"/events/{event_id}").status_code == 404
+
+
+def test_foreign_keys_are_enforced(client, new_user):
+    # The cascades rely on PRAGMA foreign_keys, set on every connection
+    user = new_user()
+    with Session(engine) as session:
+        session.add(Registration(username=user["username"], event_id=999999))
+        with pytest.raises(IntegrityError):
+            session.commit()
+
+
+@pytest.fixture(params=["single-statement", "check-then-insert", "batched"])
+def registration_path(request, monkeypatch, client):
+    monkeypatch.setattr(config, "fast_registration", request.param != "check-then-insert")
+    if request.param != "batched":
+        yield
+        return
+    monkeypatch.setattr(config, "registration_batching", True)
+    client.portal.call(registration_batcher.start) # In the event loop of the application
+    yield
+    client.portal.call(registration_batcher.stop)
+
+
+def test_register(client, new_user, new_event, registration_path):
+    user, event_id = new_user(), new_event()
+    assert client.post(f"/events/{event_id}/register", json=user).status_code == 200
+    assert _registrations_of(client, "event_id", event_id) == [{"username": user["username"], "event_id": event_id}]
+
+
+def test_register_errors(client, new_user, new_event, registration_path):
+    user, event_id = new_user(), new_event()
+    assert client.post(f"/events/{event_id}/register", json=user).status_code == 200
+
+    nobody = {"username": "nobody", "name": "Nobody", "email": "nobody@test.it"}
+    assert client.post(f"/events/{event_id}/register", json=nobody).status_code == 404 # Unknown user
+    assert client.post(f"/events/{event_id}/register", json=dict(user, name="Other")).status_code == 409 # Mismatch
+    assert client.post("/events/999999/register", json=user).status_code == 404 # Unknown event
+    assert client.post(f"/events/{event_id}/register", json=user).status_code == 409 # Already registered
+    # The user is checked before the event
+    assert client.post("/events/999999/register", json=nobody).status_code == 404
+
+
+def test_batched_registrations_share_a_commit(client, new_user, new_event, monkeypatch):
+    monkeypatch.setattr(config, "registration_batching", True)
+    monkeypatch.setattr(config, "registration_batch_interval", 200) # Long enough to gather every request
+    users, event_id = [new_user() for _ in range(5)], new_event()
+    batches = registration_batcher.batches
+    client.portal.call(registration_batcher.start)
+    try:
+        with ThreadPoolExecutor(len(users)) as executor:
+            responses = list(executor.map(lambda user: client.post(f"/events/{event_id}/register", json=user), users))
+    finally:
+        client.portal.call(registration_batcher.stop)
+
+    assert [response.status_code for response in responses] == [200] * len(users)
+    assert len(_registrations_of(client, "event_id", event_id)) == len(users)
+    assert registration_batcher.batches - batches < len(users)
+
+
+def test_concurrent_deletes_release_a_single_seat(client, new_user, new_event):
+    event_id = new_event(capacity=3)
+    user = new_user()
+    assert client.post(f"/events/{event_id}/register", json=user).is_success
+
+    def delete_registration(_):
+        return client.delete("/registrations", params={"username": user["username"], "event_id": event_id}).status_code
+
+    with ThreadPoolExecutor(5) as executor:
+        status_codes = sorted(executor.map(delete_registration, range(5)))
+    assert status_codes == [200, 404, 404, 404, 404]
+    assert client.get(f"/events/{event_id}").json()["registered_count"] == 0
+
+    # The released seat was counted once: the capacity still holds
+    users = [new_user() for _ in range(4)]
+    status_codes = [client.post(f"/events/{event_id}/register", json=user).status_code for user in users]
+    assert status_codes == [200, 200, 200, 409]
+
+
+def test_delete_missing_registration(client, new_user, new_event):
+    event_id = new_event()
+    user = new_user()
+    response = client.delete("/registrations", params={"username": user["username"], "event_id": event_id})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Registration not found"
+
+
+def test_bulk_registration_when_seats_are_taken_meanwhile(client, new_user, new_event, monkeypatch):
+    event_id = new_event(capacity=3)
+    users = [new_user() for _ in range(3)]
+    take_seats = events.take_seats
+
+    async def take_seats_after_another_request(session, id, seats=1):
+        # Another registration takes a seat after the free seats were read
+        monkeypatch.setattr(events, "take_seats", take_seats)
+        await session.exec(update(Event).where(Event.id == id).values(registered_count=Event.registered_count + 1))
+        return await take_seats(session, id, seats)
+
+    monkeypatch.setattr(events, "take_seats", take_seats_after_another_request)
+    response = client.post(f"/events/{event_id}/register/bulk", json=users)
+    assert response.status_code == 200, response.text
+    assert [result["status_code"] for result in response.json()] == [201, 201, 409]
+    assert client.get(f"/events/{event_id}").json()["registered_count"] == 3
+
+
+def test_cursor_values_of_the_wrong_type(client, new_event):
+    event_id = new_event()
+    for cursor in (encode_cursor([1]), encode_cursor(None), encode_cursor(1)):
+        assert client.get(f"/events/{event_id}/registrations", params={"after": cursor}).status_code == 400
+    for cursor in (encode_cursor("test", "1"), encode_cursor("test", None), encode_cursor(1, 1)):
+        assert client.get("/registrations", params={"after": cursor}).status_code == 400
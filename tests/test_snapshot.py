@@ -0,0 +1,18 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import config
+from app.data.snapshot import snapshot
+
+
+def test_concurrent_refreshes_copy_once(client, monkeypatch):
+    monkeypatch.setattr(config, "snapshot_interval", 60)
+    snapshot.path.unlink(missing_ok=True)
+
+    # Like many workers finding no copy at the same time
+    with ThreadPoolExecutor(4) as executor:
+        copied = list(executor.map(lambda _: snapshot.refresh(), range(4)))
+    assert sorted(copied) == [False, False, False, True]
+    assert not list(snapshot.path.parent.glob(f"{snapshot.path.name}.*.tmp"))
+    with sqlite3.connect(snapshot.path) as connection:
+        assert connection.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
@@ -0,0 +1,166 @@
+import json
+import uuid
+
+from sqlmodel import Session, text
+
+from app.data.db import engine
+from app.data.pagination import encode_cursor
+from app.models.user import User
+from app.routers import users
+
+
+def test_pages_sorted_by_username(client, new_user):
+    for _ in range(3):
+        new_user()
+    usernames, params = [], {"limit": 2}
+    while True:
+        response = client.get("/users", params=params)
+        usernames += [user["username"] for user in response.json()]
+        if "x-next-cursor" not in response.headers:
+            break
+        params["after"] = response.headers["x-next-cursor"]
+
+    every_user = client.get("/users", params={"all": "true"}).json()
+    assert usernames == sorted(user["username"] for user in every_user)
+    assert len(set(usernames)) == len(usernames)
+
+
+def test_fields_projection(client, new_user):
+    user = new_user()
+    users = client.get("/users", params={"all": "true", "fields": "email"}).json()
+    assert {"email": user["email"]} in users
+
+
+def test_bulk_create_reports_every_row(client, new_user):
+    existing = new_user()
+    rows = [
+        {"username": f"{existing['username']}-bulk", "name": "Bulk", "email": f"bulk-{existing['email']}"},
+        {"username": f"{existing['username']}-other", "name": "Bulk", "email": existing["email"]}, # Email taken
+        {"username": existing["username"], "name": "Bulk", "email": f"other-{existing['email']}"}, # Username taken
+        {"username": f"{existing['username']}-bulk", "name": "Bulk", "email": f"again-{existing['email']}"}, # In the request
+        {"username": f"{existing['username']}-invalid"}, # Missing fields
+    ]
+    response = client.post("/users/bulk", json=rows)
+    assert response.status_code == 200, response.text
+    results = response.json()
+    assert [result["index"] for result in results] == list(range(len(rows)))
+    assert [result["status_code"] for result in results] == [201, 409, 409, 409, 422]
+    assert results[1]["detail"] == "Email already registered"
+    assert results[2]["detail"] == "Username is already taken"
+    assert client.get(f"/users/{rows[0]['username']}").status_code == 200
+
+
+def test_bulk_create_from_ndjson(client):
+    body = '{"username": "ndjson-1", "name": "N", "email": "ndjson-1@test.it"}\n\nnot json\n'
+    response = client.post("/users/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert [result["status_code"] for result in response.json()] == [201, 422]
+
+
+def test_bulk_body_must_be_a_list(client):
+    assert client.post("/users/bulk", json={"username": "x"}).status_code == 400
+
+
+def test_duplicate_email(client, new_user):
+    user = new_user()
+    response = client.post("/users", json=dict(user, username=f"{user['username']}-other"))
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Email already registered"
+
+
+def _search(client, **params) -> list[str]:
+    # Every page of the search, as usernames
+    usernames = []
+    while True:
+        response = client.get("/users", params=params)
+        assert response.status_code == 200, response.text
+        usernames += [user["username"] for user in response.json()]
+        if "x-next-cursor" not in response.headers:
+            return usernames
+        params["after"] = response.headers["x-next-cursor"]
+
+
+def test_prefix_search(client):
+    prefix = uuid.uuid4().hex
+    users = [{"username": f"{prefix}-{letter}", "name": f"{prefix} {name}", "email": f"{letter}-{prefix}@test.it"}
+             for letter, name in (("c", "alice"), ("a", "Bob"), ("b", "ALAN"))]
+    for user in users:
+        assert client.post("/users", json=user).is_success
+
+    assert _search(client, prefix=prefix, limit=2) == [f"{prefix}-a", f"{prefix}-b", f"{prefix}-c"]
+    assert _search(client, prefix=f"{prefix}-b") == [f"{prefix}-b"]
+    # The names and the emails ignore the case, sorted by value and then by username
+    assert _search(client, prefix=f"{prefix.upper()} al", field="name", limit=1) == [f"{prefix}-b", f"{prefix}-c"]
+    assert _search(client, prefix=f"A-{prefix}", field="email") == [f"{prefix}-a"]
+    assert _search(client, prefix=f"{prefix}-z") == []
+    # The fields projection and the exports keep the search
+    assert client.get("/users", params={"prefix": prefix, "fields": "email"}).json()[0] == {"email": users[1]["email"]}
+    exported = client.get("/users", params={"prefix": prefix}, headers={"Accept": "application/x-ndjson"}).text
+    assert [json.loads(line)["username"] for line in exported.splitlines()] == [f"{prefix}-a", f"{prefix}-b", f"{prefix}-c"]
+
+
+def test_username_search_is_not_shadowed(client):
+    # The search is a query parameter of the list, so a user named "search" has its own route
+    response = client.post("/users", json={"username": "search", "name": "Search", "email": "search@test.it"})
+    assert response.is_success, response.text
+    response = client.get("/users/search")
+    assert response.status_code == 200, response.text
+    assert response.json()["username"] == "search"
+    assert client.delete("/users/search").is_success
+
+
+def test_search_limit(client):
+    response = client.get("/users", params={"prefix": "test-", "limit": 1})
+    assert len(response.json()) == 1 and "x-next-cursor" in response.headers
+    assert client.get("/users", params={"prefix": ""}).status_code == 422
+
+
+def test_prefix_search_uses_the_index(client):
+    with engine.connect() as connection:
+        plan = " ".join(row[-1] for row in connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT username FROM user WHERE name COLLATE NOCASE >= :start "
+            "AND name COLLATE NOCASE < :end ORDER BY name COLLATE NOCASE, username"), {"start": "al", "end": "am"}))
+    assert "ix_user_name_nocase" in plan and "TEMP B-TREE" not in plan
+
+
+def test_cursor_values_of_the_wrong_type(client):
+    for cursor in (encode_cursor(None), encode_cursor(1), encode_cursor(["test"])):
+        assert client.get("/users", params={"after": cursor}).status_code == 400
+        assert client.get("/users", params={"prefix": "test", "after": cursor}).status_code == 400
+    cursor = encode_cursor(None, "test")
+    assert client.get("/users", params={"prefix": "test", "field": "name", "after": cursor}).status_code == 400
+
+
+def test_bulk_create_with_a_user_created_meanwhile(client, new_user, monkeypatch):
+    prefix = uuid.uuid4().hex
+    rows = [{"username": f"{prefix}-{number}", "name": "Bulk", "email": f"{prefix}-{number}@test.it"}
+            for number in range(3)]
+    check_new_users = users._check_new_users
+
+    async def check_then_create_a_duplicate(session, chunk, results):
+        # Another request creates the second user after the check
+        monkeypatch.setattr(users, "_check_new_users", check_new_users)
+        new_users = await check_new_users(session, chunk, results)
+        with Session(engine) as other_session:
+            other_session.add(User(**dict(rows[1], name="Other")))
+            other_session.commit()
+        return new_users
+
+    monkeypatch.setattr(users, "_check_new_users", check_then_create_a_duplicate)
+    response = client.post("/users/bulk", json=rows)
+    assert response.status_code == 200, response.text
+    assert [result["status_code"] for result in response.json()] == [201, 409, 201]
+    assert client.get(f"/users/{rows[1]['username']}").json()["name"] == "Other"
+    assert client.get(f"/users/{rows[2]['username']}").status_code == 200
+
+
+def test_pages_of_the_key_alone(client, new_user):
+    for _ in range(3):
+        new_user()
+    usernames, params = [], {"limit": 2, "fields": "username"}
+    while True:
+        response = client.get("/users", params=params)
+        usernames += response.json()
+        if "x-next-cursor" not in response.headers:
+            break
+        params["after"] = response.headers["x-next-cursor"]
+    assert usernames == client.get("/users", params={"all": "true", "fields": "username"}).json()